@@ -1,23 +1,51 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
 from datetime import timedelta
 
-from app.core.security import verify_password, get_password_hash
+from app.core.config import settings
+from app.core.security import (
+    HashingBusy, Principal, get_current_active_superuser, load_user, password_hasher,
+    principal_claims, store_password_hash, verify_and_update_password
+)
 from app.core.jwt import create_access_token
-from app.db.session import get_db
-from app.models.user import User
 
 router = APIRouter()
 
 @router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    """
+    Issues an access token. The user lookup and any rehash are written
+    off the event loop, like the password check.
+    """
+    user = await load_user(form_data.username)
+    if not user:
         raise HTTPException(status_code=400, detail="Incorrect credentials")
-    
+    try:
+        valid, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    except HashingBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many logins in progress",
+            headers={"Retry-After": "1"}
+        )
+    if not valid:
+        raise HTTPException(status_code=400, detail="Incorrect credentials")
+    if new_hash is not None:
+        # BCRYPT_ROUNDS changed since this password was hashed
+        await store_password_hash(user.id, new_hash)
+
+    claims = {"sub": user.email}
+    if settings.AUTH_EMBED_CLAIMS:
+        claims.update(principal_claims(user))
     access_token = create_access_token(
-        data={"sub": user.email},
+        data=claims,
         expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/hashing-status")
+def get_hashing_status(current_user: Principal = Depends(get_current_active_superuser)):
+    """
+    Queue depth and timings of the password hashing pool.
+    """
+    return password_hasher.stats()
@@ -0,0 +1,98 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+
+from app.api.v1.endpoints.channels import owner_redirect, supervisor
+from app.core.config import settings
+from app.streaming.origin import PartialSegmentRing, SegmentResponse, memory_origin, wait_for_playlist
+from app.streaming.viewers import viewer_key
+
+# Mounted at /hls_streams when HLS_ORIGIN_MODE is "memory"
+router = APIRouter()
+
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+PLAYLIST_HEADERS = {
+    "Cache-Control": f"public, max-age={settings.HLS_PLAYLIST_MAX_AGE}",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+}
+
+SEGMENT_HEADERS = {
+    "Cache-Control": "public, max-age=60",
+    "Access-Control-Allow-Origin": "*",
+}
+
+
+def track_viewer(channel_name: str, request: Request):
+    client_host = request.client.host if request.client else None
+    supervisor.touch(channel_name, viewer_key(client_host, request.headers.get("user-agent")))
+
+
+@router.put("/_ingest/{channel_name}/{token}/{filename}")
+async def ingest_upload(channel_name: str, token: str, filename: str, request: Request):
+    """
+    Receives playlists and segments that FFmpeg uploads with -method PUT.
+    Only accepted over loopback and with the token issued at process start.
+    """
+    if request.client is None or request.client.host not in LOOPBACK_HOSTS:
+        raise HTTPException(status_code=403, detail="Ingest is only accepted from localhost")
+    if not memory_origin.check_token(channel_name, token):
+        raise HTTPException(status_code=403, detail="Invalid ingest token")
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+    memory_origin.ingest(channel_name, filename, memoryview(body))
+    return Response(status_code=201)
+
+
+@router.get("/{channel_name}/master.m3u8")
+@router.head("/{channel_name}/master.m3u8")
+async def get_memory_playlist(
+    channel_name: str,
+    request: Request,
+    msn: Optional[int] = Query(None, alias="_HLS_msn", ge=0),
+    part: Optional[int] = Query(None, alias="_HLS_part", ge=0)
+):
+    """
+    Serves the live playlist rendered from the channel's in-memory ring.
+    Low-latency channels hold _HLS_msn/_HLS_part requests until that
+    segment or part is listed.
+    """
+    track_viewer(channel_name, request)
+    ring = memory_origin.ring(channel_name)
+    if ring is None or not ring.has_media:
+        redirect = await owner_redirect(channel_name, request) if ring is None else None
+        if redirect is not None:
+            return redirect
+        raise HTTPException(status_code=404, detail="Stream not found")
+    await wait_for_playlist(ring, msn, part)
+    return Response(
+        content=ring.render_playlist(),
+        media_type="application/x-mpegurl",
+        headers=PLAYLIST_HEADERS
+    )
+
+
+@router.get("/{channel_name}/{segment_name}")
+@router.head("/{channel_name}/{segment_name}")
+async def get_memory_segment(channel_name: str, segment_name: str, request: Request):
+    """
+    Serves a segment straight from the ring without touching the disk.
+    The part named by a low-latency playlist's preload hint is sent as
+    soon as it arrives.
+    """
+    track_viewer(channel_name, request)
+    ring = memory_origin.ring(channel_name)
+    segment = ring.get(segment_name) if ring is not None else None
+    if segment is None and isinstance(ring, PartialSegmentRing) and segment_name == ring.next_part_name:
+        if await ring.wait_until(lambda: ring.get(segment_name) is not None, ring.part_target * 3):
+            segment = ring.get(segment_name)
+    if segment is None:
+        redirect = await owner_redirect(channel_name, request) if ring is None else None
+        if redirect is not None:
+            return redirect
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return SegmentResponse(content=segment.data, headers=SEGMENT_HEADERS)
@@ -0,0 +1,123 @@
+import os
+import time
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+
+from app.api.v1.endpoints.channels import HLS_OUTPUT_DIR, read_file, supervisor
+from app.api.v1.endpoints.hls import track_viewer
+from app.core.config import settings
+from app.streaming.origin import SegmentResponse
+from app.streaming.playlists import etag_matches
+from app.streaming.resource_cache import Resource, ResourceCache
+from app.streaming.segment_files import SegmentFileResponse, file_etag, open_segment, parse_range
+
+# Mounted at /hls_streams when HLS_ORIGIN_MODE is "disk"
+router = APIRouter()
+
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+# Hot segments stay in RAM at most this long; they leave the playlist much sooner
+SEGMENT_CACHE_TTL = 60
+
+PLAYLIST_HEADERS = {
+    "Cache-Control": f"public, max-age={settings.HLS_PLAYLIST_MAX_AGE}",
+    "Access-Control-Allow-Origin": "*",
+}
+
+# Finished segments never change; segment numbers are unique across FFmpeg runs
+FINISHED_SEGMENT_CACHE_CONTROL = f"public, max-age={settings.HLS_SEGMENT_MAX_AGE}, immutable"
+
+segment_cache = ResourceCache(settings.HLS_SEGMENT_CACHE_BYTES) if settings.HLS_SEGMENT_CACHE_BYTES > 0 else None
+
+
+def channel_file(channel_name: str, name: str) -> str:
+    if channel_name.startswith(".") or name.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    return os.path.join(HLS_OUTPUT_DIR, channel_name, name)
+
+
+def read_segment(path: str) -> Resource:
+    with open(path, "rb") as f:
+        data = f.read()
+    return Resource(path, data, "video/mp2t", time.monotonic() + SEGMENT_CACHE_TTL)
+
+
+@router.get("/{channel_name}/{playlist_name}.m3u8")
+@router.head("/{channel_name}/{playlist_name}.m3u8")
+async def get_disk_playlist(channel_name: str, playlist_name: str, request: Request):
+    """
+    Serves a playlist FFmpeg wrote to disk. A short max-age lets a CDN
+    collapse the polling of many viewers into one request per second.
+    """
+    track_viewer(channel_name, request)
+    body = await run_in_threadpool(read_file, channel_file(channel_name, f"{playlist_name}.m3u8"))
+    if body is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return Response(content=body, media_type="application/x-mpegurl", headers=PLAYLIST_HEADERS)
+
+
+@router.get("/{channel_name}/{segment_name}")
+@router.head("/{channel_name}/{segment_name}")
+async def get_disk_segment(channel_name: str, segment_name: str, request: Request):
+    """
+    Serves a segment with Range support. Segments the index knows FFmpeg
+    closed are immutable: they get a strong ETag and a long cache lifetime,
+    and are handed to nginx (X-Accel-Redirect), sent with sendfile when
+    the server supports it, or served from the in-memory segment cache.
+    Segments still being written are sent as they are, uncached.
+    """
+    if not segment_name.endswith(".ts"):
+        # ffmpeg.log and anything else in the channel directory stay private
+        raise HTTPException(status_code=404, detail="Not found")
+    track_viewer(channel_name, request)
+    path = channel_file(channel_name, segment_name)
+    entry = supervisor.segment_index.get(channel_name)
+    segment = entry.segments.get(segment_name) if entry is not None else None
+    finished = segment is not None and segment.closed
+
+    try:
+        f, st = await run_in_threadpool(open_segment, path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    headers = {"Accept-Ranges": "bytes", "Access-Control-Allow-Origin": "*"}
+    if not finished:
+        headers["Cache-Control"] = "no-cache"
+    else:
+        etag = file_etag(st)
+        headers["ETag"] = etag
+        headers["Cache-Control"] = FINISHED_SEGMENT_CACHE_CONTROL
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            f.close()
+            return Response(status_code=304, headers=headers)
+        if settings.HLS_ACCEL_REDIRECT_PREFIX:
+            # nginx serves the file itself with sendfile and handles Range
+            f.close()
+            prefix = settings.HLS_ACCEL_REDIRECT_PREFIX.rstrip("/")
+            headers["X-Accel-Redirect"] = f"{prefix}/{quote(channel_name)}/{quote(segment_name)}"
+            return Response(status_code=200, headers=headers, media_type="video/mp2t")
+
+    try:
+        byte_range = parse_range(request.headers.get("range"), st.st_size)
+    except ValueError:
+        f.close()
+        headers["Content-Range"] = f"bytes */{st.st_size}"
+        return Response(status_code=416, headers=headers)
+    offset, length = byte_range or (0, st.st_size)
+    status_code = 200
+    if byte_range is not None:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {offset}-{offset + length - 1}/{st.st_size}"
+
+    if finished and segment_cache is not None and ZERO_COPY_EXTENSION not in request.scope.get("extensions", {}):
+        f.close()
+        resource = await segment_cache.get_or_fetch(
+            f"{path}\n{headers['ETag']}", lambda: run_in_threadpool(read_segment, path)
+        )
+        return SegmentResponse(
+            content=memoryview(resource.data)[offset:offset + length],
+            status_code=status_code,
+            headers=headers,
+        )
+    return SegmentFileResponse(f, offset, length, status_code, headers)
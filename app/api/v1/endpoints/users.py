@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.db.session import get_db
-from app.schemas.user import UserCreate, User
-from app.core.security import get_password_hash
-from app.db.repositories.user import create_user, get_user_by_email
+from app.schemas.user import UserCreate, UserUpdate, User
+from app.core.security import HashingBusy, Principal, get_current_active_superuser
+from app.db.repositories.user import create_user, get_user, get_user_by_email, update_user
 
 # Router tanımı burada olmalı
 router = APIRouter()
@@ -13,11 +13,30 @@ def create_new_user(user: UserCreate, db: Session = Depends(get_db)):
     db_user = get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return create_user(db=db, user=user)
+    try:
+        return create_user(db=db, user=user)
+    except HashingBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many password hashes in progress",
+            headers={"Retry-After": "1"}
+        )
 
 @router.get("/{user_id}", response_model=User)
 def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = get_user(db, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
\ No newline at end of file
+    return db_user
+
+@router.patch("/{user_id}", response_model=User)
+def update_existing_user(
+    user_id: int,
+    changes: UserUpdate,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_superuser)
+):
+    db_user = get_user(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return update_user(db, db_user, **changes.dict(exclude_unset=True))
\ No newline at end of file
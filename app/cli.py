@@ -0,0 +1,82 @@
+"""
+Command line tools for the IPTV backend.
+
+    python -m app.cli import-m3u path/to/playlist.m3u
+    python -m app.cli probe [--channel ID ...]
+"""
+import argparse
+import asyncio
+import sys
+
+from app.core.config import settings
+from app.core.m3u import iter_lines
+from app.db.base import Base
+from app.db.migrations import upgrade_schema
+from app.db.repositories.channel import channel_cache, import_m3u
+from app.db.session import SessionLocal, engine
+from app.models import user  # noqa: F401  Registers the users table favorites refer to
+from app.streaming.prober import ChannelProber
+
+
+def import_m3u_command(args) -> int:
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as f:
+            stats = import_m3u(db, iter_lines(f), batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(
+        f"Imported {stats['imported']} channels in {stats['batches']} batches "
+        f"({stats['seconds']}s, {stats['channels_per_second']} channels/s)"
+    )
+    return 0
+
+
+def print_probe_result(result: dict):
+    if result["ok"]:
+        print(f"OK    {result['re_stream_id']:<32} ttfb {result['ttfb_ms']}ms, {result['throughput_kbps']} kbit/s")
+    else:
+        print(f"FAIL  {result['re_stream_id']:<32} {result['error']}")
+
+
+def probe_command(args) -> int:
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    channels = channel_cache.all()
+    if args.channel:
+        wanted = set(args.channel)
+        channels = [c for c in channels if c["re_stream_id"] in wanted]
+    prober = ChannelProber(args.concurrency, args.timeout, args.segment_bytes)
+    summary = asyncio.run(prober.sweep(channels, on_result=print_probe_result, save=not args.no_save))
+    print(
+        f"Probed {summary['probed']} channels in {summary['seconds']}s: "
+        f"{summary['ok']} ok, {summary['failed']} failed"
+    )
+    return 0 if summary["failed"] == 0 else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="IPTV backend tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import-m3u", help="Import an M3U playlist into the channels table")
+    import_parser.add_argument("path", help="Path to the .m3u file")
+    import_parser.add_argument("--batch-size", type=int, default=settings.M3U_IMPORT_BATCH_SIZE)
+    import_parser.set_defaults(handler=import_m3u_command)
+
+    probe_parser = commands.add_parser("probe", help="Check every catalog channel's upstream and store the results")
+    probe_parser.add_argument("--channel", action="append", help="Only probe this stream id (repeatable)")
+    probe_parser.add_argument("--concurrency", type=int, default=settings.CHANNEL_PROBE_CONCURRENCY)
+    probe_parser.add_argument("--timeout", type=float, default=settings.CHANNEL_PROBE_TIMEOUT)
+    probe_parser.add_argument("--segment-bytes", type=int, default=settings.CHANNEL_PROBE_SEGMENT_BYTES)
+    probe_parser.add_argument("--no-save", action="store_true", help="Print the results without storing them")
+    probe_parser.set_defaults(handler=probe_command)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+from typing import Set
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -5,9 +6,84 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "your-secret-key-here"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
+    BCRYPT_ROUNDS: int = 12  # bcrypt cost factor, older hashes are upgraded at login
+    PASSWORD_HASH_WORKERS: int = 0  # Threads hashing passwords, 0 means one per CPU core
+    PASSWORD_HASH_MAX_QUEUE: int = 256  # Logins waiting beyond this get 503, 0 means unbounded
+    AUTH_PRINCIPAL_CACHE_TTL: int = 60  # Seconds an authenticated user is reused without a DB read
+    AUTH_PRINCIPAL_CACHE_SIZE: int = 10000  # Max cached users, least recently used go first
+    AUTH_EMBED_CLAIMS: bool = False  # Sign is_active and plan into tokens so requests skip the DB
+    AUTH_CLAIMS_TTL: int = 300  # Embedded claims are trusted for this long after the token is issued
     
     # Database
     SQLALCHEMY_DATABASE_URI: str = "sqlite:///./iptv.db"
+    DB_POOL_SIZE: int = 10  # Connections kept open per engine
+    DB_MAX_OVERFLOW: int = 20  # Extra connections opened under load
+    DB_POOL_RECYCLE: int = 1800  # Reconnect connections older than this many seconds
+    DB_POOL_TIMEOUT: float = 30  # Seconds to wait for a free connection before failing
+    DB_ASYNC: bool = False  # Also create an AsyncSession engine (needs aiosqlite or asyncpg)
+    DB_ASYNC_URI: str = ""  # Async URL, derived from SQLALCHEMY_DATABASE_URI when empty
+
+    # Catalog
+    M3U_IMPORT_BATCH_SIZE: int = 1000  # Channels upserted per transaction during M3U imports
+    CHANNEL_PROBE_CONCURRENCY: int = 50  # Upstream channels probed at once
+    CHANNEL_PROBE_TIMEOUT: float = 10  # Seconds allowed for each request of a probe
+    CHANNEL_PROBE_SEGMENT_BYTES: int = 512 * 1024  # Bytes of a segment downloaded to measure throughput
+    CHANNEL_PROBE_INTERVAL: int = 0  # Seconds between background probes of the whole catalog, 0 disables
+
+    # Playlists
+    PLAYLIST_MAX_AGE: int = 60  # Cache-Control max-age for M3U playlists, revalidated by ETag
+
+    # Direct proxy
+    PROXY_MODE: str = "redirect"  # "redirect" sends /proxy viewers upstream, "relay" shares one upstream connection per channel
+    RELAY_CLIENT_QUEUE: int = 128  # Chunks buffered per relay client; a client further behind is dropped
+    RELAY_IDLE_GRACE: float = 10  # Seconds a relay's upstream stays open after its last client left
+    RELAY_TIMEOUT: float = 15  # Connect and read timeout of relay upstream connections
+    PASSTHROUGH_TIMEOUT: float = 10  # Timeout of upstream requests of pass-through HLS channels
+    PASSTHROUGH_MAX_CONNECTIONS: int = 100  # Pooled keep-alive connections to pass-through upstreams
+    PASSTHROUGH_PLAYLIST_TTL: float = 1  # Seconds an upstream playlist is shared between viewers
+    PASSTHROUGH_SEGMENT_TTL: float = 60  # Seconds an upstream segment stays cached
+    PASSTHROUGH_CACHE_BYTES: int = 256 * 1024 * 1024  # Memory cap of the pass-through cache
+
+    # HLS streaming
+    HLS_READY_TIMEOUT: float = 15.0  # Max seconds a cold-start request waits for the first segment
+    HLS_RETRY_AFTER: int = 3  # Retry-After sent with 503 when a stream is not ready in time
+    HLS_ORIGIN_MODE: str = "disk"  # "disk" serves hls_streams/ files, "memory" serves from RAM
+    HLS_MEMORY_SEGMENTS: int = 8  # Segments kept per channel in memory mode
+    HLS_PLAYLIST_MAX_AGE: int = 1  # Cache-Control max-age of /hls_streams playlists (whole seconds)
+    HLS_SEGMENT_MAX_AGE: int = 86400  # Cache lifetime of finished, immutable segments
+    HLS_SEGMENT_CACHE_BYTES: int = 64 * 1024 * 1024  # RAM for hot disk segments, 0 disables
+    HLS_ACCEL_REDIRECT_PREFIX: str = ""  # nginx internal location aliasing hls_streams/, serves finished segments with sendfile
+    HLS_INGEST_BASE_URL: str = "http://127.0.0.1:8000"  # This app over loopback, for FFmpeg uploads and relay input
+    HLS_ABR_LADDER: str = "1080:5000,720:2800,480:1400,360:800"  # height:video kbps renditions of ABR channels
+    HLS_ABR_AUDIO_KBPS: int = 128  # AAC bitrate of every ABR rendition
+    HLS_ABR_PRESET: str = "veryfast"  # x264 preset of ABR channels, trades CPU for quality
+    HLS_LL_PART_DURATION: float = 0.5  # LL-HLS part length; players stay 3 parts behind live
+    HLS_LL_SEGMENT_DURATION: float = 2.0  # LL-HLS segment length, rounded to whole parts
+    HLS_LL_PRESET: str = "veryfast"  # x264 preset of low-latency channels
+    STREAM_IDLE_GRACE: int = 120  # Stop a channel after this many seconds without viewers, 0 disables
+    STREAM_VIEWER_WINDOW: int = 30  # A viewer counts as watching for this long after its last fetch
+    STREAM_KEEP_WARM: Set[str] = set()  # Stream ids started at boot and never stopped for idleness
+    STREAM_MAX_TRANSCODERS: int = 0  # Max concurrent FFmpeg processes, 0 means unlimited
+    STREAM_COST_BUDGET: float = 0  # Max sum of per-channel "cost" weights, 0 means unlimited
+    STREAM_EVICTION_POLICY: str = "lru"  # "lru" or "least_watched" when evicting idle channels
+    STREAM_ADMISSION_WAIT: float = 5.0  # Seconds a start waits for capacity before giving up
+    STREAM_PROGRESS_STALL: float = 10  # Restart when FFmpeg's output clock stops this long, 0 disables
+    STREAM_MIN_SPEED: float = 0.8  # Encoding speed (x real time) below which a channel counts as slow
+    STREAM_SLOW_GRACE: float = 30  # Restart after being slow this long, 0 disables
+    STREAM_LOG_MAX_BYTES: int = 1024 * 1024  # ffmpeg.log is rotated at this size, 0 disables rotation
+    STREAM_LOG_BACKUPS: int = 2  # Rotated ffmpeg.log.N files kept per channel
+    STREAM_RESTART_BASE_DELAY: float = 2  # Wait before restarting a crashed or stalled channel, doubled per consecutive failure
+    STREAM_RESTART_MAX_DELAY: float = 60  # Upper bound of the restart delay
+    STREAM_RESTART_JITTER: float = 0.2  # Random +/- fraction applied to each restart delay
+    STREAM_BREAKER_FAILURES: int = 5  # Failures within STREAM_BREAKER_WINDOW that stop restarting a channel, 0 disables
+    STREAM_BREAKER_WINDOW: float = 300  # Seconds; a run this long also resets the restart delay
+    STREAM_BREAKER_COOLDOWN: float = 120  # Seconds before one retry of a channel whose circuit opened, doubled while it keeps failing
+    STREAM_REGISTRY: str = "database"  # Who runs each channel's FFmpeg: "local" (one worker), "database" (the app DB) or a redis:// URL
+    STREAM_LEASE_TTL: float = 15  # Seconds a worker owns a channel without renewing; renewed every third of it, taken over after it
+    STREAM_NODE_URL: str = ""  # Public base URL of this node; other nodes redirect memory-origin viewers of its channels here
+    STREAM_RESTART_STAGGER: float = 0.5  # Pause between restarts in /restart-all-streams
+    CACHE_SYNC_INTERVAL: float = 1  # Seconds between checks for catalog and user changes other workers made, 0 for a single worker
+    CACHE_SYNC_WINDOW: float = 30  # Seconds a change stays visible to those checks; must exceed the longest write transaction
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,52 @@
+import hashlib
+import re
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+ATTRIBUTE = re.compile(r'([\w-]+)="([^"]*)"')
+NON_SLUG = re.compile(r"[^a-z0-9]+")
+
+def slugify(value: str) -> str:
+    return NON_SLUG.sub("_", value.lower()).strip("_")
+
+def make_stream_id(tvg_id: Optional[str], name: str, url: str) -> str:
+    """
+    Stream id for an imported entry. tvg-id is stable across provider
+    refreshes; without it the name plus a short URL hash keeps ids unique.
+    """
+    if tvg_id and slugify(tvg_id):
+        return slugify(tvg_id)
+    return f"{slugify(name) or 'channel'}_{hashlib.sha1(url.encode()).hexdigest()[:8]}"
+
+def iter_lines(stream: BinaryIO) -> Iterator[str]:
+    """Decodes a binary file line by line without reading it all into memory."""
+    for raw in stream:
+        yield raw.decode("utf-8", "replace").lstrip("\ufeff").strip()
+
+def iter_m3u_entries(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Parses #EXTINF entries from an M3U playlist one at a time.
+    Yields dicts with tvg_id, tvg_name, tvg_logo, group_title, language, name and url.
+    """
+    current = None
+    for line in lines:
+        if not line:
+            continue
+        if line.startswith("#EXTINF"):
+            header, _, title = line.partition(",")
+            attributes = dict(ATTRIBUTE.findall(header))
+            current = {
+                "tvg_id": attributes.get("tvg-id") or None,
+                "tvg_name": attributes.get("tvg-name") or None,
+                "tvg_logo": attributes.get("tvg-logo") or None,
+                "group_title": attributes.get("group-title") or None,
+                "language": attributes.get("tvg-language") or None,
+                "name": title.strip() or attributes.get("tvg-name") or "",
+            }
+        elif line.startswith("#EXTGRP:") and current is not None:
+            current["group_title"] = current["group_title"] or line[len("#EXTGRP:"):].strip()
+        elif line.startswith("#"):
+            continue
+        elif current is not None:
+            current["url"] = line
+            yield current
+            current = None
@@ -0,0 +1,245 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Counters and histograms are updated where things happen (requests,
+FFmpeg lifecycle, cleanup); scraping /metrics only formats what is
+already in memory.
+"""
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, values))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(Metric):
+    """
+    Incremented directly, or read at scrape time from collect() for totals
+    kept elsewhere; collect() must return values that never decrease.
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        collect: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        super().__init__(name, help, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+        self.collect = collect
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        values = self.collect() if self.collect is not None else self.values
+        for key, value in values.items():
+            yield f"{self.name}{self._format_labels(key)} {_number(value)}"
+
+
+class Gauge(Metric):
+    """
+    Set directly, or computed at scrape time by collect(), which returns
+    {label values: value} and must only read in-memory state.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        collect: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        super().__init__(name, help, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def remove(self, **labels):
+        self.values.pop(self._key(labels), None)
+
+    def samples(self):
+        values = self.collect() if self.collect is not None else self.values
+        for key, value in values.items():
+            yield f"{self.name}{self._format_labels(key)} {_number(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (last one is +Inf), sum
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{self._format_labels(key)} {_number(total[0])}"
+            yield f"{self.name}_count{self._format_labels(key)} {cumulative}"
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+REGISTRY: List[Metric] = []
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# HTTP
+http_requests = Counter("iptv_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_latency = Histogram("iptv_http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+bytes_served = Counter("iptv_bytes_served_total", "Playlist and segment bytes sent to clients", ("kind",))
+
+# Transcoders
+ffmpeg_starts = Counter("iptv_ffmpeg_starts_total", "FFmpeg processes started", ("channel",))
+ffmpeg_restarts = Counter("iptv_ffmpeg_restarts_total", "FFmpeg restarts after a crash or stall", ("channel",))
+ffmpeg_crashes = Counter("iptv_ffmpeg_crashes_total", "FFmpeg processes that exited on their own", ("channel",))
+circuit_trips = Counter("iptv_stream_circuit_trips_total", "Times a failing channel's restart circuit opened", ("channel",))
+stream_takeovers = Counter("iptv_stream_takeovers_total", "Channels this worker took over after their owner's lease expired", ("channel",))
+stream_leases_lost = Counter("iptv_stream_leases_lost_total", "Running channels stopped because another worker took their lease", ("channel",))
+time_to_first_segment = Histogram(
+    "iptv_time_to_first_segment_seconds", "Seconds from FFmpeg start to the first playable segment",
+    ("channel",), buckets=(0.5, 1, 2, 3, 5, 8, 12, 20, 30, 60),
+)
+segment_lag = Gauge("iptv_segment_lag_seconds", "Seconds since the channel last produced output", ("channel",))
+cleanup_duration = Histogram("iptv_cleanup_duration_seconds", "Duration of one segment cleanup pass")
+
+# Upstream prober
+channel_probes = Counter("iptv_channel_probes_total", "Upstream channel probes by result", ("result",))
+channel_probe_ttfb = Histogram(
+    "iptv_channel_probe_ttfb_seconds", "Time to first byte of upstream channel URLs",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+
+# Direct proxy relay
+relay_bytes = Counter("iptv_relay_bytes_total", "Bytes read from upstream and written to clients by /proxy relays", ("channel", "direction"))
+relay_clients_dropped = Counter("iptv_relay_clients_dropped_total", "Relay clients dropped for falling behind", ("channel",))
+
+# HLS pass-through
+passthrough_fetches = Counter("iptv_passthrough_fetches_total", "Upstream playlist and segment fetches of pass-through channels", ("result",))
+passthrough_fetch_seconds = Histogram(
+    "iptv_passthrough_fetch_seconds", "Duration of successful pass-through upstream fetches",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and status per route template and
+    the bytes of playlists and segments it sends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        kind = None
+
+        async def send_wrapper(message):
+            nonlocal status, kind
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = dict(message.get("headers") or []).get(b"content-type", b"")
+                if b"mpegurl" in content_type:
+                    kind = "playlist"
+                elif b"mp2t" in content_type:
+                    kind = "segment"
+            elif message["type"] == "http.response.body" and kind is not None:
+                bytes_served.inc(len(message.get("body", b"")), kind=kind)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; mounts only set root_path
+            route = scope.get("route")
+            template = getattr(route, "path", None) or scope.get("root_path") or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method=method, route=template, status=status)
+            http_latency.observe(time.perf_counter() - started, method=method, route=template)
@@ -1,22 +1,228 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from app.core import metrics
 from app.core.config import settings
-from app.db.session import get_db
-from sqlalchemy.orm import Session
+from app.db.invalidation import cache_invalidations
+from app.db.session import AsyncSessionLocal, SessionLocal
 from app.models.user import User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with another cost are upgraded on the next successful login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/auth/login")
 
+class Principal:
+    """
+    Snapshot of the authenticated user's fields that endpoints read.
+    Detached from any session, so it can be cached between requests.
+    """
+
+    __slots__ = ("id", "email", "is_active", "is_superuser", "subscription_plan")
+
+    def __init__(self, id: int, email: str, is_active: bool, is_superuser: bool, subscription_plan: Optional[str]):
+        self.id = id
+        self.email = email
+        self.is_active = is_active
+        self.is_superuser = is_superuser
+        self.subscription_plan = subscription_plan
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user.id, user.email, bool(user.is_active), bool(user.is_superuser), user.subscription_plan)
+
+class PrincipalCache:
+    """
+    TTL- and size-bounded cache of principals keyed by token subject.
+    Also remembers when a user last changed, so older signed claims are ignored.
+    Changes reach the other workers through the invalidation log.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Used from the event loop and from threadpool threads (update_user)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+        self._changed_at: Dict[str, float] = {}
+        # When every user was last dropped at once
+        self._all_changed_at = 0.0
+
+    def get(self, subject: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                del self._entries[subject]
+                return None
+            self._entries.move_to_end(subject)
+            return principal
+
+    def put(self, subject: str, principal: Principal):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[subject] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject: Optional[str], changed_at: Optional[float] = None, publish: bool = True):
+        """
+        Call after a user's status or plan changes; None drops every user.
+        `publish` passes the change on to the other workers.
+        """
+        if publish:
+            cache_invalidations.publish("principals", subject)
+        now = time.time()
+        if changed_at is None:
+            changed_at = now
+        with self._lock:
+            if subject is None:
+                self._entries.clear()
+                self._all_changed_at = max(self._all_changed_at, changed_at)
+            else:
+                self._entries.pop(subject, None)
+                self._changed_at[subject] = max(self._changed_at.get(subject, 0.0), changed_at)
+            # Claims older than AUTH_CLAIMS_TTL are not trusted anyway
+            horizon = now - settings.AUTH_CLAIMS_TTL
+            for key in [k for k, t in self._changed_at.items() if t < horizon]:
+                del self._changed_at[key]
+
+    def changed_since(self, subject: str, issued_at: float) -> bool:
+        with self._lock:
+            changed_at = max(self._changed_at.get(subject, 0.0), self._all_changed_at)
+        return changed_at >= issued_at
+
+principal_cache = PrincipalCache(settings.AUTH_PRINCIPAL_CACHE_TTL, settings.AUTH_PRINCIPAL_CACHE_SIZE)
+cache_invalidations.subscribe(
+    "principals", lambda subject, changed_at: principal_cache.invalidate(subject, changed_at, publish=False)
+)
+
+def principal_claims(user: User) -> dict:
+    """
+    Extra token claims for AUTH_EMBED_CLAIMS. They are signed with the token,
+    so requests carrying fresh claims skip the user lookup entirely.
+    """
+    return {
+        "uid": user.id,
+        "active": bool(user.is_active),
+        "su": bool(user.is_superuser),
+        "plan": user.subscription_plan,
+        "iat": int(time.time()),
+    }
+
+def principal_from_claims(subject: str, payload: dict) -> Optional[Principal]:
+    if not settings.AUTH_EMBED_CLAIMS or "uid" not in payload or "iat" not in payload:
+        return None
+    issued_at = payload["iat"]
+    if issued_at + settings.AUTH_CLAIMS_TTL < time.time() or principal_cache.changed_since(subject, issued_at):
+        return None
+    return Principal(payload["uid"], subject, payload.get("active", False), payload.get("su", False), payload.get("plan"))
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already waiting."""
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool so hashing never blocks the
+    event loop and cannot take over FastAPI's shared threadpool.
+    bcrypt releases the GIL, so the pool is sized to the CPU cores.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+    def submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self.max_queue and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise HashingBusy()
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        return self._executor.submit(self._run, time.perf_counter(), fn, *args)
+
+    def _run(self, submitted_at: float, fn, *args):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += started - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.total_run += time.perf_counter() - started
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "workers": self.workers,
+                "rounds": settings.BCRYPT_ROUNDS,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "max_queue_depth": self.max_queued,
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / done * 1000, 1),
+                "avg_hash_ms": round(self.total_run / done * 1000, 1),
+            }
+
+password_hasher = PasswordHasher(
+    settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1,
+    settings.PASSWORD_HASH_MAX_QUEUE,
+)
+
+metrics.Gauge(
+    "iptv_password_hash_queue_depth", "Password hashes waiting for a worker",
+    collect=lambda: {(): password_hasher.queued},
+)
+
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    # Blocks the calling thread; only call from sync endpoints
+    return password_hasher.submit(pwd_context.hash, password).result()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.submit(pwd_context.verify, plain_password, hashed_password).result()
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password off the event loop. The second value is a new hash
+    when the stored one was made with a different cost, else None.
+    """
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -27,10 +233,39 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
+def _load_user(email: str) -> Optional[User]:
+    db = SessionLocal()
+    try:
+        return db.query(User).filter(User.email == email).first()
+    finally:
+        db.close()
+
+async def load_user(email: str) -> Optional[User]:
+    """
+    Looks a user up without blocking the event loop, through the async
+    engine when DB_ASYNC is on and the threadpool otherwise.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(User).where(User.email == email))
+            return result.scalars().first()
+    return await run_in_threadpool(_load_user, email)
+
+def _store_password_hash(user_id: int, hashed_password: str):
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.id == user_id).update(
+            {"hashed_password": hashed_password}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+async def store_password_hash(user_id: int, hashed_password: str):
+    """Replaces a user's password hash from the threadpool."""
+    await run_in_threadpool(_store_password_hash, user_id, hashed_password)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -43,18 +278,34 @@ async def get_current_user(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = db.query(User).filter(User.email == email).first()
+
+    principal = principal_from_claims(email, payload) or principal_cache.get(email)
+    if principal is not None:
+        return principal
+
+    user = await load_user(email)
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.put(email, principal)
+    return principal
 
 async def get_current_active_user(
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: Principal = Depends(get_current_user)
+) -> Principal:
     if not current_user.is_active:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Inactive user"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_current_active_superuser(
+    current_user: Principal = Depends(get_current_active_user)
+) -> Principal:
+    if not current_user.is_superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough privileges"
+        )
+    return current_user
@@ -0,0 +1,132 @@
+import asyncio
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.cache_invalidation import CacheInvalidation
+
+
+class InvalidationLog:
+    """
+    Tells the other workers sharing the database which cached entries
+    changed. Writers add a row after their commit; every worker polls the
+    rows of the last `window` seconds and hands the ones it has not seen
+    yet to the cache's handler. Reading a time window instead of "ids
+    after the last one" also catches rows whose transaction committed
+    out of id order.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        interval: float = 1,
+        window: float = 30,
+        retention: float = 3600,
+    ):
+        self.session_factory = session_factory
+        # 0 turns the log off, for a single worker
+        self.interval = interval
+        self.window = window
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, Callable[[Optional[str], float], None]] = {}
+        # Row id -> created_at of rows already handled, forgotten after `window`
+        self._seen: Dict[int, float] = {}
+        self._last_pruned = 0.0
+        self._polled_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, cache: str, handler: Callable[[Optional[str], float], None]):
+        """`handler(key, changed_at)` drops an entry another worker changed; key None means all."""
+        self._handlers[cache] = handler
+
+    def publish(self, cache: str, key: Optional[str] = None):
+        """Records a change made by this worker. Call after the change is committed."""
+        if self.interval <= 0:
+            return
+        db = self.session_factory()
+        try:
+            now = time.time()
+            db.add(CacheInvalidation(cache=cache, key=key, origin=self.origin, created_at=now))
+            if now - self._last_pruned > self.retention / 10:
+                self._last_pruned = now
+                db.query(CacheInvalidation).filter(
+                    CacheInvalidation.created_at < now - self.retention
+                ).delete(synchronize_session=False)
+            db.commit()
+        except SQLAlchemyError as e:
+            # The write itself went through; other workers catch up when their entries expire
+            db.rollback()
+            print(f"Could not publish a '{cache}' cache invalidation: {e}")
+        finally:
+            db.close()
+
+    def _recent(self) -> List[CacheInvalidation]:
+        db = self.session_factory()
+        try:
+            rows = db.query(CacheInvalidation).filter(
+                CacheInvalidation.created_at > time.time() - self.window
+            ).order_by(CacheInvalidation.id).all()
+            db.expunge_all()
+            return rows
+        finally:
+            db.close()
+
+    async def poll(self):
+        """Applies the changes other workers published since the last poll."""
+        started = time.time()
+        rows = await asyncio.get_running_loop().run_in_executor(None, self._recent)
+        if self._polled_at and started - self._polled_at > self.window:
+            # Changes may have left the window unseen while polls failed
+            for handler in self._handlers.values():
+                handler(None, started)
+        self._polled_at = started
+        horizon = started - self.window
+        for key in [k for k, created_at in self._seen.items() if created_at < horizon]:
+            del self._seen[key]
+        for row in rows:
+            if row.id in self._seen:
+                continue
+            self._seen[row.id] = row.created_at
+            handler = self._handlers.get(row.cache)
+            if row.origin != self.origin and handler is not None:
+                handler(row.key, row.created_at)
+
+    def start(self):
+        """Polls every `interval` seconds; must run inside the event loop."""
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._poll_forever())
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _poll_forever(self):
+        # Rows written before this worker started describe state it loads fresh anyway
+        try:
+            started = time.time()
+            for row in await asyncio.get_running_loop().run_in_executor(None, self._recent):
+                self._seen[row.id] = row.created_at
+            self._polled_at = started
+        except SQLAlchemyError as e:
+            print(f"Could not read cache invalidations: {e}")
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except SQLAlchemyError as e:
+                print(f"Could not read cache invalidations: {e}")
+
+cache_invalidations = InvalidationLog(
+    interval=settings.CACHE_SYNC_INTERVAL,
+    window=settings.CACHE_SYNC_WINDOW,
+)
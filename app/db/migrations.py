@@ -0,0 +1,86 @@
+from typing import Set
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from app.core.m3u import make_stream_id
+
+
+def backfill_stream_ids(conn: Connection):
+    """Gives channels stored before re_stream_id existed the id an M3U import would."""
+    used = {
+        row[0] for row in conn.execute(text("SELECT re_stream_id FROM channels WHERE re_stream_id IS NOT NULL"))
+    }
+    rows = conn.execute(text("SELECT id, name, url FROM channels WHERE re_stream_id IS NULL")).fetchall()
+    for channel_id, name, url in rows:
+        stream_id = make_stream_id(None, name or "", url or "")
+        if stream_id in used:
+            stream_id = f"{stream_id}_{channel_id}"
+        used.add(stream_id)
+        conn.execute(
+            text("UPDATE channels SET re_stream_id = :stream_id WHERE id = :id"),
+            {"stream_id": stream_id, "id": channel_id},
+        )
+    if conn.dialect.name != "sqlite":
+        # SQLite cannot add NOT NULL to an existing column; the model enforces it on insert
+        conn.execute(text("ALTER TABLE channels ALTER COLUMN re_stream_id SET NOT NULL"))
+
+
+# (table, column, column type and default, backfill run in the same transaction)
+COLUMNS = [
+    ("channels", "re_stream_id", "VARCHAR", backfill_stream_ids),
+    ("channels", "cost", "FLOAT DEFAULT 1.0", None),
+    ("channels", "abr", "BOOLEAN DEFAULT FALSE", None),
+    ("channels", "low_latency", "BOOLEAN DEFAULT FALSE", None),
+    ("channels", "passthrough", "BOOLEAN DEFAULT FALSE", None),
+]
+
+# (index name, table, columns, unique)
+INDEXES = [
+    ("ix_channels_re_stream_id", "channels", ("re_stream_id",), True),
+    ("ix_channels_m3u_group_id", "channels", ("m3u_group", "id"), False),
+    ("ix_channels_category_id", "channels", ("category", "id"), False),
+    ("ix_channels_language_id", "channels", ("language", "id"), False),
+]
+
+
+def _columns(engine: Engine, table: str) -> Set[str]:
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+
+def _indexes(engine: Engine, table: str) -> Set[str]:
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def upgrade_schema(engine: Engine):
+    """
+    Adds the columns and indexes create_all skips on tables that already
+    exist. Every step checks first and tolerates another worker running
+    it at the same time, so this runs at every startup.
+    """
+    for table, column, definition, backfill in COLUMNS:
+        if column in _columns(engine, table):
+            continue
+        print(f"Adding column {table}.{column}")
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                if backfill is not None:
+                    backfill(conn)
+        except DBAPIError:
+            if column not in _columns(engine, table):
+                raise
+
+    for name, table, columns, unique in INDEXES:
+        if name in _indexes(engine, table):
+            continue
+        print(f"Creating index {name}")
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+                ))
+        except DBAPIError:
+            if name not in _indexes(engine, table):
+                raise
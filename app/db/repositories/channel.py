@@ -1,17 +1,470 @@
+import threading
+import time
+from collections import OrderedDict
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from app.core.m3u import iter_m3u_entries, make_stream_id
 from app.models.channel import Channel
+from app.models.channel_health import ChannelHealth
+from app.models.favorite import Favorite
 from app.schemas.channel import ChannelBase
+from app.db.invalidation import cache_invalidations
+from app.db.session import SessionLocal
+
+# Columns an M3U import owns; cost, category and is_premium are left to admins
+IMPORT_COLUMNS = ("name", "url", "logo", "m3u_group", "language")
+
+# Columns written by the upstream prober
+HEALTH_COLUMNS = (
+    "ok", "status_code", "error", "ttfb_ms", "throughput_kbps",
+    "checked_at", "last_ok_at", "failures",
+)
+
+# Fields returned by the channel listing API
+PAGE_COLUMNS = (
+    "id", "name", "url", "re_stream_id", "category", "language",
+    "logo", "is_premium", "m3u_group", "cost", "abr", "low_latency",
+    "passthrough",
+)
+
+def channel_to_dict(channel: Channel) -> dict:
+    """
+    Plain dict snapshot of a channel, safe to share between requests
+    after the session that loaded it is closed.
+    """
+    return {
+        "id": channel.id,
+        "name": channel.name,
+        "url": channel.url,
+        "re_stream_id": channel.re_stream_id,
+        "logo": channel.logo or "",
+        "group": channel.m3u_group or "",
+        "category": channel.category,
+        "language": channel.language,
+        "is_premium": bool(channel.is_premium),
+        "cost": channel.cost if channel.cost is not None else 1.0,
+        "abr": bool(channel.abr),
+        "low_latency": bool(channel.low_latency),
+        "passthrough": bool(channel.passthrough),
+    }
+
+class ChannelCache:
+    """
+    Process-local read-through cache of the channel catalog keyed by
+    re_stream_id. Writes through the repository functions below invalidate it
+    here and, through the invalidation log, in the other workers.
+    Reads run in threadpool threads while invalidations run on the event
+    loop, so the dicts are guarded by a lock and a read only stores its
+    rows when no invalidation happened while it queried.
+    """
+
+    # Unknown ids are remembered too, but only this many of them
+    MAX_MISSES = 10000
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        # Bumped by every invalidation
+        self.generation = 0
+        self._by_stream_id: Dict[str, Optional[dict]] = {}
+        self._misses = 0
+        self._all: Optional[List[dict]] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, listener: Callable[[], None]):
+        """Registers a callback that runs whenever the catalog changes."""
+        self._listeners.append(listener)
+
+    def peek(self, stream_id: str) -> Tuple[bool, Optional[dict]]:
+        """The cached value and whether there was one, without touching the database."""
+        with self._lock:
+            if stream_id in self._by_stream_id:
+                return True, self._by_stream_id[stream_id]
+            return False, None
+
+    def get(self, stream_id: str) -> Optional[dict]:
+        with self._lock:
+            if stream_id in self._by_stream_id:
+                return self._by_stream_id[stream_id]
+            generation = self.generation
+
+        db = self.session_factory()
+        try:
+            channel = get_channel_by_stream_id(db, stream_id)
+            value = channel_to_dict(channel) if channel else None
+        finally:
+            db.close()
+
+        with self._lock:
+            if self.generation != generation:
+                # Invalidated while querying; the row may predate the change
+                return value
+            if value is None:
+                self._misses += 1
+                if self._misses > self.MAX_MISSES:
+                    self._forget_misses()
+            self._by_stream_id[stream_id] = value
+        return value
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            if self._all is not None:
+                return self._all
+            generation = self.generation
+
+        db = self.session_factory()
+        try:
+            channels = [channel_to_dict(c) for c in db.query(Channel).order_by(Channel.id).all()]
+        finally:
+            db.close()
+
+        with self._lock:
+            if self.generation == generation:
+                self._all = channels
+                for channel in channels:
+                    self._by_stream_id[channel["re_stream_id"]] = channel
+        return channels
+
+    def invalidate(self, stream_id: Optional[str] = None, publish: bool = True):
+        """
+        Drops one channel (or everything) and the full list, then notifies
+        listeners. `publish` passes the change on to the other workers.
+        """
+        if publish:
+            cache_invalidations.publish("channels", stream_id)
+        with self._lock:
+            self.generation += 1
+            if stream_id is None:
+                self._by_stream_id.clear()
+                self._misses = 0
+            else:
+                self._by_stream_id.pop(stream_id, None)
+            self._all = None
+        for listener in self._listeners:
+            listener()
+
+    def _forget_misses(self):
+        # Called with the lock held
+        for key in [k for k, v in self._by_stream_id.items() if v is None]:
+            del self._by_stream_id[key]
+        self._misses = 0
+
+channel_cache = ChannelCache()
+cache_invalidations.subscribe(
+    "channels", lambda stream_id, changed_at: channel_cache.invalidate(stream_id, publish=False)
+)
+
+class ChannelPageCache:
+    """
+    Bounded LRU of channel listing pages keyed by filter set and cursor.
+    Emptied whenever the catalog changes.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; pages queried before one are not stored
+        self.generation = 0
+        self._pages: "OrderedDict[Tuple, dict]" = OrderedDict()
+
+    def get(self, key: Tuple) -> Optional[dict]:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key: Tuple, page: dict, generation: int):
+        """Stores a page queried when the cache was at `generation`."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._pages.clear()
+
+channel_page_cache = ChannelPageCache()
+channel_cache.add_listener(channel_page_cache.invalidate)
+
+def health_to_dict(health: ChannelHealth) -> dict:
+    row = {column: getattr(health, column) for column in HEALTH_COLUMNS}
+    row["re_stream_id"] = health.re_stream_id
+    return row
+
+class ChannelHealthCache:
+    """
+    Last probe result per re_stream_id, read from channel_health once and
+    then kept current by save_channel_health. Listeners run when a probe
+    sweep has finished.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+        self._by_stream_id: Optional[Dict[str, dict]] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, listener: Callable[[], None]):
+        self._listeners.append(listener)
+
+    def all(self) -> Dict[str, dict]:
+        if self._by_stream_id is None:
+            db = self.session_factory()
+            try:
+                self._by_stream_id = {row.re_stream_id: health_to_dict(row) for row in db.query(ChannelHealth).all()}
+            finally:
+                db.close()
+        return self._by_stream_id
+
+    def get(self, stream_id: str) -> Optional[dict]:
+        return self.all().get(stream_id)
+
+    def put(self, rows: List[dict]):
+        by_stream_id = self.all()
+        for row in rows:
+            by_stream_id[row["re_stream_id"]] = row
+
+    def notify(self):
+        for listener in self._listeners:
+            listener()
+
+channel_health_cache = ChannelHealthCache()
 
 def get_channels(db: Session, skip: int = 0, limit: int = 100):
     return db.query(Channel).offset(skip).limit(limit).all()
 
+def list_channels(
+    db: Session,
+    after_id: Optional[int] = None,
+    limit: int = 100,
+    group: Optional[str] = None,
+    category: Optional[str] = None,
+    language: Optional[str] = None,
+    is_premium: Optional[bool] = None,
+    q: Optional[str] = None,
+) -> dict:
+    """
+    One page of channels ordered by id. Pages continue from after_id
+    instead of an OFFSET, so late pages cost the same as the first one.
+    """
+    query = db.query(Channel)
+    if group is not None:
+        query = query.filter(Channel.m3u_group == group)
+    if category is not None:
+        query = query.filter(Channel.category == category)
+    if language is not None:
+        query = query.filter(Channel.language == language)
+    if is_premium is not None:
+        query = query.filter(Channel.is_premium == is_premium)
+    if q:
+        # Range instead of LIKE so the name index is used (case-sensitive prefix)
+        query = query.filter(Channel.name >= q, Channel.name < q + "\uffff")
+    if after_id is not None:
+        query = query.filter(Channel.id > after_id)
+
+    # One extra row tells whether another page exists
+    rows = query.order_by(Channel.id).limit(limit + 1).all()
+    items = [
+        {column: getattr(row, column) for column in PAGE_COLUMNS}
+        for row in rows[:limit]
+    ]
+    return {
+        "items": items,
+        "next_after_id": items[-1]["id"] if len(rows) > limit else None,
+    }
+
 def get_channel(db: Session, channel_id: int):
     return db.query(Channel).filter(Channel.id == channel_id).first()
 
+def get_channel_by_stream_id(db: Session, stream_id: str):
+    return db.query(Channel).filter(Channel.re_stream_id == stream_id).first()
+
 def create_channel(db: Session, channel: ChannelBase):
     db_channel = Channel(**channel.dict())
     db.add(db_channel)
     db.commit()
     db.refresh(db_channel)
-    return db_channel
\ No newline at end of file
+    channel_cache.invalidate(db_channel.re_stream_id)
+    return db_channel
+
+def update_channel(db: Session, db_channel: Channel, **fields):
+    old_stream_id = db_channel.re_stream_id
+    for key, value in fields.items():
+        setattr(db_channel, key, value)
+    db.commit()
+    db.refresh(db_channel)
+    if old_stream_id != db_channel.re_stream_id:
+        channel_cache.invalidate(old_stream_id)
+    channel_cache.invalidate(db_channel.re_stream_id)
+    return db_channel
+
+def delete_channel(db: Session, db_channel: Channel):
+    stream_id = db_channel.re_stream_id
+    db.delete(db_channel)
+    db.commit()
+    channel_cache.invalidate(stream_id)
+
+def seed_channels(db: Session, channels: List[dict]) -> int:
+    """
+    Fills an empty channels table from a list of static channel dicts.
+    """
+    if db.query(Channel.id).first() is not None:
+        return 0
+    for channel in channels:
+        db.add(Channel(
+            name=channel["name"],
+            url=channel["url"],
+            re_stream_id=channel["re_stream_id"],
+            logo=channel.get("logo"),
+            m3u_group=channel.get("group"),
+            cost=channel.get("cost", 1.0),
+            abr=channel.get("abr", False),
+            low_latency=channel.get("low_latency", False),
+            passthrough=channel.get("passthrough", False),
+        ))
+    db.commit()
+    channel_cache.invalidate()
+    return len(channels)
+
+def upsert_by_stream_id(db: Session, model, rows: List[dict], columns: Iterable[str]):
+    """
+    Inserts or updates a batch of rows keyed by re_stream_id in one
+    executemany; existing rows only get `columns` overwritten. Does not commit.
+    """
+    if not rows:
+        return
+    dialect = db.bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(model.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.re_stream_id],
+            set_={column: stmt.excluded[column] for column in columns},
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Generic fallback: one lookup per batch, then bulk insert and bulk update
+    stream_ids = [row["re_stream_id"] for row in rows]
+    existing = dict(
+        db.query(model.re_stream_id, model.id).filter(model.re_stream_id.in_(stream_ids)).all()
+    )
+    inserts = [row for row in rows if row["re_stream_id"] not in existing]
+    updates = [dict(row, id=existing[row["re_stream_id"]]) for row in rows if row["re_stream_id"] in existing]
+    db.bulk_insert_mappings(model, inserts)
+    db.bulk_update_mappings(model, updates)
+
+def upsert_channels(db: Session, rows: List[dict]):
+    """Upserts a batch of imported channels. Does not commit."""
+    upsert_by_stream_id(db, Channel, rows, IMPORT_COLUMNS)
+
+def import_m3u(db: Session, lines: Iterable[str], batch_size: int = 1000) -> dict:
+    """
+    Streams M3U entries into the channels table, upserting one batch per
+    transaction so memory stays flat regardless of the playlist size.
+    """
+    started = time.perf_counter()
+    batch: Dict[str, dict] = {}
+    imported = 0
+    batches = 0
+    # Providers reuse one tvg-id for HD/SD/backup entries
+    seen_tvg_ids = set()
+
+    def flush():
+        nonlocal imported, batches
+        if not batch:
+            return
+        upsert_channels(db, list(batch.values()))
+        db.commit()
+        imported += len(batch)
+        batches += 1
+        batch.clear()
+
+    try:
+        for entry in iter_m3u_entries(lines):
+            tvg_id = entry["tvg_id"]
+            if tvg_id in seen_tvg_ids:
+                # Only the first entry gets the tvg-id; the others are told apart by URL
+                tvg_id = None
+            elif tvg_id:
+                seen_tvg_ids.add(tvg_id)
+            stream_id = make_stream_id(tvg_id, entry["tvg_name"] or entry["name"], entry["url"])
+            # Later duplicates in the same batch win, like they would across batches
+            batch[stream_id] = {
+                "re_stream_id": stream_id,
+                "name": entry["name"] or entry["tvg_name"] or stream_id,
+                "url": entry["url"],
+                "logo": entry["tvg_logo"],
+                "m3u_group": entry["group_title"],
+                "language": entry["language"],
+                "is_premium": False,
+                "cost": 1.0,
+                "abr": False,
+                "low_latency": False,
+                "passthrough": False,
+            }
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if imported:
+            channel_cache.invalidate()
+
+    seconds = time.perf_counter() - started
+    return {
+        "imported": imported,
+        "batches": batches,
+        "seconds": round(seconds, 3),
+        "channels_per_second": round(imported / seconds, 1) if seconds > 0 else None,
+    }
+
+def get_favorite_stream_ids(db: Session, user_id: int) -> List[str]:
+    rows = db.query(Favorite.re_stream_id).filter(Favorite.user_id == user_id).order_by(Favorite.id).all()
+    return [row.re_stream_id for row in rows]
+
+def add_favorite(db: Session, user_id: int, stream_id: str) -> bool:
+    """Returns False when the channel already was a favorite."""
+    exists = db.query(Favorite.id).filter(
+        Favorite.user_id == user_id, Favorite.re_stream_id == stream_id
+    ).first()
+    if exists is not None:
+        return False
+    db.add(Favorite(user_id=user_id, re_stream_id=stream_id))
+    db.commit()
+    return True
+
+def remove_favorite(db: Session, user_id: int, stream_id: str) -> bool:
+    deleted = db.query(Favorite).filter(
+        Favorite.user_id == user_id, Favorite.re_stream_id == stream_id
+    ).delete()
+    db.commit()
+    return deleted > 0
+
+def save_channel_health(db: Session, results: List[dict]) -> List[dict]:
+    """
+    Stores a batch of probe results, carrying the failure streak and the
+    last success over from the previous result of each channel.
+    """
+    rows = []
+    for result in results:
+        previous = channel_health_cache.get(result["re_stream_id"]) or {}
+        row = dict(result)
+        if row["ok"]:
+            row["failures"] = 0
+            row["last_ok_at"] = row["checked_at"]
+        else:
+            row["failures"] = (previous.get("failures") or 0) + 1
+            row["last_ok_at"] = previous.get("last_ok_at")
+        rows.append(row)
+    upsert_by_stream_id(db, ChannelHealth, rows, HEALTH_COLUMNS)
+    db.commit()
+    channel_health_cache.put(rows)
+    return rows
@@ -1,7 +1,7 @@
 from sqlalchemy.orm import Session
 from app.models.user import User
 from app.schemas.user import UserCreate
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash, principal_cache
 
 def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
@@ -12,4 +12,16 @@ def create_user(db: Session, user: UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    return db_user
+
+def get_user(db: Session, user_id: int):
+    return db.query(User).filter(User.id == user_id).first()
+
+def update_user(db: Session, db_user: User, **fields):
+    for key, value in fields.items():
+        setattr(db_user, key, value)
+    db.commit()
+    db.refresh(db_user)
+    # Cached principals and signed claims issued before this change are stale
+    principal_cache.invalidate(db_user.email)
+    return db_user
@@ -1,12 +1,103 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.core import metrics
 from app.core.config import settings
 
+class PoolWaitStats:
+    """How long requests waited for a pooled connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            pool_checkout_wait.observe(waited)
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / (self.checkouts or 1) * 1000, 2),
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+            }
+
+pool_wait_stats = PoolWaitStats()
+
+pool_checkout_wait = metrics.Histogram(
+    "iptv_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+class _TimedCheckout:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_wait_stats.record(time.perf_counter() - started)
+        return connection
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def engine_options(url: str) -> dict:
+    """Pool settings from Settings; in-memory SQLite keeps SQLAlchemy's default pool."""
+    options = {"pool_pre_ping": True}  # Bağlantı sorunlarını otomatik çözmek için
+    if is_sqlite(url):
+        # Sessions are opened in FastAPI's threadpool and may be used from the event loop
+        options["connect_args"] = {"check_same_thread": False}
+        if ":memory:" in url or url.rstrip("/").endswith(("sqlite:", "sqlite+aiosqlite:")):
+            return options
+    options.update(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+    )
+    return options
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run while a writer commits; synchronous=NORMAL is
+    durable in WAL mode and avoids an fsync per transaction.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 # SQLAlchemy veritabanı bağlantısını oluştur
+_options = engine_options(settings.SQLALCHEMY_DATABASE_URI)
 engine = create_engine(
     settings.SQLALCHEMY_DATABASE_URI,
-    pool_pre_ping=True  # Bağlantı sorunlarını otomatik çözmek için
+    poolclass=TimedQueuePool if "pool_size" in _options else None,
+    **_options
 )
+if is_sqlite(settings.SQLALCHEMY_DATABASE_URI):
+    event.listen(engine, "connect", set_sqlite_pragmas)
 
 # SessionLocal fabrikasını oluştur
 SessionLocal = sessionmaker(
@@ -15,6 +106,39 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+def async_database_uri(url: str) -> str:
+    """Maps the sync URL to its async driver unless DB_ASYNC_URI is set."""
+    if settings.DB_ASYNC_URI:
+        return settings.DB_ASYNC_URI
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if url.startswith(("postgresql://", "postgres://")):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.DB_ASYNC:
+    # Needs the async driver (aiosqlite or asyncpg) installed
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    _async_uri = async_database_uri(settings.SQLALCHEMY_DATABASE_URI)
+    _async_options = engine_options(_async_uri)
+    async_engine = create_async_engine(
+        _async_uri,
+        poolclass=TimedAsyncAdaptedQueuePool if "pool_size" in _async_options else None,
+        **_async_options
+    )
+    if is_sqlite(_async_uri):
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    AsyncSessionLocal = sessionmaker(
+        async_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False
+    )
+
 # Dependency (Bağımlılık) fonksiyonu
 def get_db():
     """
@@ -25,4 +149,13 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """
+    AsyncSession for async endpoints; requires DB_ASYNC.
+    """
+    if AsyncSessionLocal is None:
+        raise RuntimeError("DB_ASYNC is disabled")
+    async with AsyncSessionLocal() as db:
+        yield db
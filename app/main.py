@@ -1,9 +1,12 @@
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from app.core.config import settings
-from app.api.v1.endpoints import auth, channels, users
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.db.base import Base
+from app.db.migrations import upgrade_schema
+from app.db.session import engine, pool_wait_stats
+from app.api.v1.endpoints import auth, channels, hls, hls_files, users
 
 # Define the directory where HLS streams are stored
 HLS_OUTPUT_DIR = "hls_streams"
@@ -14,9 +17,22 @@ if not os.path.exists(HLS_OUTPUT_DIR):
 
 app = FastAPI(title="IPTV Backend", version="1.0.0")
 
-# Mount the HLS streams directory to be served as static files
-# This makes the hls_streams directory publicly accessible
-app.mount("/hls_streams", StaticFiles(directory=HLS_OUTPUT_DIR), name="hls_streams")
+@app.on_event("startup")
+def create_tables():
+    """
+    Creates missing tables before the routers' startup handlers run,
+    then adds columns and indexes that existing tables lack.
+    """
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+if settings.HLS_ORIGIN_MODE == "memory":
+    # Playlists and segments are kept in RAM and served by the in-memory origin
+    app.include_router(hls.router, prefix="/hls_streams", tags=["hls"])
+else:
+    # Playlists and segments FFmpeg writes to hls_streams/; every fetch
+    # counts as viewer activity for idle shutdown
+    app.include_router(hls_files.router, prefix="/hls_streams", tags=["hls"])
 
 # CORS ayarları
 app.add_middleware(
@@ -27,6 +43,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the latency includes CORS handling
+app.add_middleware(MetricsMiddleware)
+
 # API rotaları
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(users.router, prefix="/api/v1/users", tags=["users"])
@@ -36,3 +55,20 @@ app.include_router(channels.router, prefix="/api/v1/channels", tags=["channels"]
 def read_root():
     return {"message": "IPTV Backend Service"}
 
+@app.get("/metrics")
+def read_metrics():
+    """
+    Prometheus text exposition of the in-process counters.
+    """
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/db-status")
+def read_db_status():
+    """
+    Connection pool usage and how long requests waited for a connection.
+    """
+    pool = engine.pool
+    status = {"pool": pool.__class__.__name__, "checkout_wait": pool_wait_stats.stats()}
+    if hasattr(pool, "size"):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return status
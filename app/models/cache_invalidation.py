@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Float, Integer, String
+from app.db.base import Base
+
+class CacheInvalidation(Base):
+    """A cached entry one worker changed, for the other workers to drop."""
+    __tablename__ = "cache_invalidations"
+
+    id = Column(Integer, primary_key=True)
+    # Which cache, e.g. "channels"
+    cache = Column(String, nullable=False)
+    # Entry key; NULL drops the whole cache
+    key = Column(String)
+    # Worker that made the change and already dropped its own copy
+    origin = Column(String, nullable=False)
+    # Unix time; nodes sharing the table need synchronized clocks
+    created_at = Column(Float, nullable=False, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, Text  # Gerekli tipleri import edin
+from sqlalchemy import Boolean, Column, Float, Index, Integer, String, Text  # Gerekli tipleri import edin
 from app.db.base import Base
 
 class Channel(Base):
@@ -7,8 +7,26 @@ class Channel(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     url = Column(String)
+    # Public id used in /hls, /proxy and /hls_streams URLs
+    re_stream_id = Column(String, unique=True, index=True, nullable=False)
     category = Column(String)
     language = Column(String)
     logo = Column(String)
     is_premium = Column(Boolean, default=False)
-    m3u_group = Column(String)
\ No newline at end of file
+    m3u_group = Column(String)
+    # Relative CPU and bandwidth weight of the channel's transcoder
+    cost = Column(Float, default=1.0)
+    # Transcode to the HLS_ABR_LADDER renditions instead of copying the source
+    abr = Column(Boolean, default=False)
+    # Serve LL-HLS parts with blocking playlist reloads (memory origin mode)
+    low_latency = Column(Boolean, default=False)
+    # Serve the upstream HLS playlists and segments through our cache instead of FFmpeg
+    passthrough = Column(Boolean, default=False)
+
+    # Filter column first, id second: keyset pages within a group/category/language
+    # are a single index range scan
+    __table_args__ = (
+        Index("ix_channels_m3u_group_id", "m3u_group", "id"),
+        Index("ix_channels_category_id", "category", "id"),
+        Index("ix_channels_language_id", "language", "id"),
+    )
@@ -0,0 +1,21 @@
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String
+from app.db.base import Base
+
+class ChannelHealth(Base):
+    """Result of the last upstream probe of a channel."""
+    __tablename__ = "channel_health"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Public channel id, so results survive catalog re-imports
+    re_stream_id = Column(String, unique=True, index=True, nullable=False)
+    ok = Column(Boolean, default=False)
+    status_code = Column(Integer)
+    error = Column(String)
+    # Time to the first byte of the channel URL's response
+    ttfb_ms = Column(Float)
+    # Download rate of the first segment
+    throughput_kbps = Column(Float)
+    checked_at = Column(DateTime)
+    last_ok_at = Column(DateTime)
+    # Failed probes in a row
+    failures = Column(Integer, default=0)
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, ForeignKey, Integer, String, UniqueConstraint
+from app.db.base import Base
+
+class Favorite(Base):
+    __tablename__ = "favorites"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    # Public channel id, so favorites survive catalog re-imports
+    re_stream_id = Column(String, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "re_stream_id", name="uq_favorites_user_channel"),
+    )
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Float, String
+from app.db.base import Base
+
+class StreamLease(Base):
+    """Which worker runs a channel's transcoder, until the lease expires."""
+    __tablename__ = "stream_leases"
+
+    re_stream_id = Column(String, primary_key=True)
+    # Worker id, "host:pid:suffix"
+    owner = Column(String, nullable=False)
+    # Public base URL of the owner, for redirects between nodes
+    address = Column(String)
+    # Unix times; nodes sharing the table need synchronized clocks
+    expires_at = Column(Float, nullable=False)
+    viewed_at = Column(Float)
@@ -1,16 +1,27 @@
 from pydantic import BaseModel
+from typing import List, Optional
 
 class ChannelBase(BaseModel):
     name: str
     url: str
-    category: str = None
-    language: str = None
-    logo: str = None
+    re_stream_id: str
+    category: Optional[str] = None
+    language: Optional[str] = None
+    logo: Optional[str] = None
     is_premium: bool = False
-    m3u_group: str = None
+    m3u_group: Optional[str] = None
+    cost: float = 1.0
+    abr: bool = False
+    low_latency: bool = False
+    passthrough: bool = False
 
 class Channel(ChannelBase):
     id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class ChannelPage(BaseModel):
+    items: List[Channel]
+    # Pass as after_id to fetch the next page; None on the last page
+    next_after_id: Optional[int] = None
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr
+from typing import Optional
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -6,6 +7,10 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
 
+class UserUpdate(BaseModel):
+    is_active: Optional[bool] = None
+    subscription_plan: Optional[str] = None
+
 class User(UserBase):
     id: int
     is_active: bool
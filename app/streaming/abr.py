@@ -0,0 +1,129 @@
+import os
+from typing import List
+
+# Encoder bitrate headroom: peak rate and VBV buffer relative to the target
+MAXRATE_FACTOR = 1.07
+BUFSIZE_FACTOR = 1.5
+
+
+class Rendition:
+    """One rung of the ABR ladder."""
+
+    __slots__ = ("height", "video_kbps", "audio_kbps")
+
+    def __init__(self, height: int, video_kbps: int, audio_kbps: int):
+        self.height = height
+        self.video_kbps = video_kbps
+        self.audio_kbps = audio_kbps
+
+    @property
+    def name(self) -> str:
+        return f"{self.height}p"
+
+    @property
+    def width(self) -> int:
+        # Sources are assumed 16:9; FFmpeg keeps the real aspect ratio with scale=-2
+        return round(self.height * 16 / 9 / 2) * 2
+
+    @property
+    def playlist_name(self) -> str:
+        return f"{self.name}.m3u8"
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "resolution": f"{self.width}x{self.height}",
+            "video_kbps": self.video_kbps,
+            "audio_kbps": self.audio_kbps,
+        }
+
+
+def parse_ladder(spec: str, audio_kbps: int) -> List[Rendition]:
+    """
+    Parses "1080:5000,720:2800" (height:video kbps) into renditions,
+    highest first.
+    """
+    ladder = []
+    for rung in spec.split(","):
+        rung = rung.strip()
+        if not rung:
+            continue
+        height, _, kbps = rung.partition(":")
+        ladder.append(Rendition(int(height), int(kbps), audio_kbps))
+    return sorted(ladder, key=lambda r: r.height, reverse=True)
+
+
+def build_abr_command(
+    url: str, output_dir: str, ladder: List[Rendition], preset: str, list_size: int = 5, start_number: int = 0
+) -> List[str]:
+    """
+    FFmpeg command decoding the source once and encoding every rendition
+    from a split of the decoded video. Writes master.m3u8 with one
+    #EXT-X-STREAM-INF per rendition, plus a media playlist and segments per
+    rendition, all in `output_dir`. The source must have an audio track.
+    """
+    count = len(ladder)
+    graph = f"[0:v:0]split={count}" + "".join(f"[s{i}]" for i in range(count))
+    for i, rendition in enumerate(ladder):
+        graph += f";[s{i}]scale=-2:{rendition.height}[v{i}]"
+
+    command = [
+        "ffmpeg",
+        "-progress", "pipe:1",  # Machine-readable telemetry on stdout
+        "-nostats",
+        "-i", url,
+        "-filter_complex", graph,
+    ]
+    for i in range(count):
+        command += ["-map", f"[v{i}]", "-map", "0:a:0"]
+    command += [
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-sc_threshold", "0",
+        # Keyframe every segment boundary in every rendition, so players can switch anywhere
+        "-force_key_frames", "expr:gte(t,n_forced*2)",
+        "-c:a", "aac",
+        "-ac", "2",
+    ]
+    for i, rendition in enumerate(ladder):
+        command += [
+            f"-b:v:{i}", f"{rendition.video_kbps}k",
+            f"-maxrate:v:{i}", f"{int(rendition.video_kbps * MAXRATE_FACTOR)}k",
+            f"-bufsize:v:{i}", f"{int(rendition.video_kbps * BUFSIZE_FACTOR)}k",
+            f"-b:a:{i}", f"{rendition.audio_kbps}k",
+        ]
+    command += [
+        "-hls_time", "2",
+        "-hls_list_size", str(list_size),
+        "-hls_flags", "delete_segments+independent_segments",
+        "-hls_delete_threshold", "1",
+        "-hls_segment_type", "mpegts",
+        "-start_number", str(start_number),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(f"v:{i},a:{i},name:{r.name}" for i, r in enumerate(ladder)),
+        "-hls_segment_filename", os.path.join(output_dir, "%v_%05d.ts"),
+        "-f", "hls",
+        "-y",
+        os.path.join(output_dir, "%v.m3u8"),
+    ]
+    return command
+
+
+def rendition_shares(ladder: List[Rendition]) -> List[float]:
+    """
+    Share of the encoder's CPU time each rendition is estimated to use,
+    proportional to its pixel count. FFmpeg reports CPU per process only.
+    """
+    pixels = [r.width * r.height for r in ladder]
+    total = sum(pixels) or 1
+    return [p / total for p in pixels]
+
+
+def prefix_playlist_uris(body: bytes, prefix: str) -> bytes:
+    """Makes the relative URIs of a playlist absolute under `prefix`."""
+    lines = []
+    for line in body.decode("utf-8", "replace").splitlines():
+        if line and not line.startswith("#") and "://" not in line and not line.startswith("/"):
+            line = prefix + line
+        lines.append(line)
+    return ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,191 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+TAIL_BLOCK_SIZE = 8192
+# Buffered output is written after this many seconds or bytes, whichever comes first
+FLUSH_INTERVAL = 1.0
+FLUSH_BYTES = 64 * 1024
+
+# One thread does the file I/O of every log, in submission order
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ffmpeg-log")
+
+
+class RotatingLog:
+    """
+    Size-capped FFmpeg log. When the file reaches `max_bytes` it is renamed
+    to .1 (older ones shift up to `backups`) and a new file is started.
+
+    Every byte gets a logical offset that keeps growing across rotations
+    and restarts, so readers can poll with a cursor and never see a byte
+    twice.
+
+    Writes are buffered on the event loop and handed to the writer thread
+    in batches; opening, writing, rotating and closing the file all happen
+    there. The offsets only count bytes that reached the file.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self._open = False
+        self._buffer = bytearray()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        # Offset of the first byte of the current file, and of the next byte written
+        self.base_offset = 0
+        self.end_offset = size
+        # The same offsets as the writer thread sees them, ahead while a write is in flight
+        self._disk_base = 0
+        self._disk_end = size
+        self._written = asyncio.Event()
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def open(self):
+        self._open = True
+        self._submit(self._open_file)
+
+    def close(self):
+        if not self._open:
+            return
+        self.flush()
+        self._open = False
+        self._submit(self._close_file)
+
+    def write(self, data: bytes):
+        if not self._open or not data:
+            return
+        self._buffer += data
+        if len(self._buffer) >= FLUSH_BYTES:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(FLUSH_INTERVAL, self.flush)
+
+    def write_line(self, text: str):
+        self.write((text + "\n").encode("utf-8", "replace"))
+
+    def flush(self):
+        """Hands the buffered bytes to the writer thread."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._submit(self._write_file, data).add_done_callback(self._flushed)
+
+    def _submit(self, function, *args) -> asyncio.Future:
+        future = asyncio.get_running_loop().run_in_executor(_writer, function, *args)
+        future.add_done_callback(self._report_error)
+        return future
+
+    def _report_error(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Could not write {self.path}: {future.exception()}")
+
+    def _flushed(self, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.base_offset, self.end_offset = future.result()
+        # Wake up followers
+        self._written.set()
+        self._written = asyncio.Event()
+
+    # The methods below run in the writer thread
+
+    def _open_file(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "ab")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_file(self, data: bytes) -> Tuple[int, int]:
+        self._open_file()
+        size = self._disk_end - self._disk_base
+        if self.max_bytes and size and size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._disk_end += len(data)
+        return self._disk_base, self._disk_end
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._disk_base = self._disk_end
+        self._file = open(self.path, "ab")
+
+    def read_from(self, cursor: int, limit: int = 65536) -> Tuple[bytes, int, bool]:
+        """
+        Returns up to `limit` bytes written at or after `cursor`, the cursor
+        for the next call, and whether older bytes were rotated away.
+        Reads the file; run it in the threadpool.
+        """
+        truncated = False
+        if cursor > self.end_offset:
+            # The server restarted since the cursor was handed out
+            cursor = self.base_offset
+        if cursor < self.base_offset:
+            cursor = self.base_offset
+            truncated = True
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(cursor - self.base_offset)
+                data = f.read(min(limit, self.end_offset - cursor))
+        except OSError:
+            data = b""
+        return data, cursor + len(data), truncated
+
+    async def wait(self, cursor: int, timeout: float) -> bool:
+        """Waits until there is something after `cursor`; False on timeout."""
+        if self.end_offset > cursor:
+            return True
+        try:
+            await asyncio.wait_for(self._written.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+def tail_lines(path: str, count: int) -> List[str]:
+    """
+    Last `count` lines of a file, read backwards block by block so the
+    cost depends on the lines returned and not on the file size.
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return []
+    with f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        # One extra newline: the file usually ends with one
+        while position > 0 and data.count(b"\n") <= count:
+            step = min(TAIL_BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode("utf-8", "replace").splitlines(keepends=True)
+    return lines[-count:]
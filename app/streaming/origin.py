@@ -0,0 +1,369 @@
+import asyncio
+import math
+import re
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+from app.core.config import settings
+
+SEGMENT_NUMBER = re.compile(r"(\d+)\.ts$")
+
+# FFmpeg uploads a segment before the playlist that carries its duration;
+# only this many segments may wait for their playlist entry.
+MAX_PENDING_SEGMENTS = 4
+
+# Low-latency playlists list the parts of this many of the newest segments
+PART_SEGMENTS = 3
+
+
+class Segment:
+    """One finished media segment held in RAM."""
+
+    __slots__ = ("name", "sequence", "duration", "data", "created_at")
+
+    def __init__(self, name: str, sequence: int, duration: float, data: memoryview):
+        self.name = name
+        self.sequence = sequence
+        self.duration = duration
+        self.data = data
+        self.created_at = time.time()
+
+
+class SegmentRing:
+    """
+    Bounded ring of the last N segments of a channel.
+    Memory per channel is capped by the ring size times the segment size.
+    """
+
+    def __init__(self, capacity: int, on_first_segment: Optional[Callable[[], None]] = None):
+        self.capacity = capacity
+        self.segments: Deque[Segment] = deque(maxlen=capacity)
+        self.by_name: Dict[str, Segment] = {}
+        self.pending: "OrderedDict[str, memoryview]" = OrderedDict()
+        self.updated_at: Optional[float] = None
+        self.bytes_held = 0
+        self._on_first_segment = on_first_segment
+        self._playlists: Dict[str, bytes] = {}
+
+    def put_segment(self, name: str, data: memoryview):
+        self.pending[name] = data
+        while len(self.pending) > MAX_PENDING_SEGMENTS:
+            self.pending.popitem(last=False)
+
+    def put_playlist(self, body: bytes):
+        """
+        Moves uploaded segments into the ring once the repackager's
+        playlist announces them together with their duration.
+        """
+        for name, duration in parse_media_playlist(body):
+            data = self.pending.pop(name, None)
+            if data is None or name in self.by_name:
+                continue
+            self._append(Segment(name, segment_number(name), duration, data))
+
+    def _append(self, segment: Segment):
+        if len(self.segments) == self.segments.maxlen:
+            evicted = self.segments.popleft()
+            self.by_name.pop(evicted.name, None)
+            self.bytes_held -= len(evicted.data)
+        first = not self.segments
+        self.segments.append(segment)
+        self.by_name[segment.name] = segment
+        self.bytes_held += len(segment.data)
+        self.updated_at = time.time()
+        self._playlists.clear()
+        if first and self._on_first_segment is not None:
+            self._on_first_segment()
+
+    @property
+    def has_media(self) -> bool:
+        return bool(self.segments)
+
+    def get(self, name: str) -> Optional[Segment]:
+        return self.by_name.get(name)
+
+    def render_playlist(self, prefix: str = "") -> bytes:
+        """
+        Live media playlist for the segments currently in the ring.
+        The encoded bytes are reused until the next segment arrives.
+        """
+        cached = self._playlists.get(prefix)
+        if cached is not None:
+            return cached
+
+        segments = list(self.segments)
+        target = max((math.ceil(s.duration) for s in segments), default=1)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{target}",
+            f"#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence if segments else 0}",
+        ]
+        for segment in segments:
+            lines.append(f"#EXTINF:{segment.duration:.6f},")
+            lines.append(f"{prefix}{segment.name}")
+        body = ("\n".join(lines) + "\n").encode()
+        self._playlists[prefix] = body
+        return body
+
+
+class PartialSegmentRing(SegmentRing):
+    """
+    Ring of a low-latency (LL-HLS) channel. FFmpeg uploads parts of
+    `part_target` seconds and every `parts_per_segment` consecutive parts
+    form one full segment. The playlist lists the parts of the newest
+    segments, a preload hint for the next part and supports blocking
+    reloads; waiting requests are woken when a part arrives.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        part_target: float,
+        parts_per_segment: int,
+        on_first_segment: Optional[Callable[[], None]] = None,
+    ):
+        super().__init__(capacity, on_first_segment)
+        self.part_target = part_target
+        self.parts_per_segment = parts_per_segment
+        # Parts of the newest segments by name, and by media sequence number
+        self.parts: Dict[str, Segment] = {}
+        self.part_lists: "OrderedDict[int, List[Segment]]" = OrderedDict()
+        # Media sequence number of the segment parts are arriving for, and the last complete one
+        self.current_msn: Optional[int] = None
+        self.completed_msn = -1
+        self.next_part = 0
+        self.max_part_duration = part_target
+        self._changed = asyncio.Event()
+
+    @property
+    def has_media(self) -> bool:
+        return bool(self.parts) or bool(self.segments)
+
+    def get(self, name: str) -> Optional[Segment]:
+        return self.by_name.get(name) or self.parts.get(name)
+
+    def _append(self, part: Segment):
+        msn, index = divmod(part.sequence, self.parts_per_segment)
+        if msn <= self.completed_msn:
+            return
+        first = self.current_msn is None
+        # A part of a newer segment closes the open one, even if one of its parts went missing
+        for open_msn in [m for m in self.part_lists if self.completed_msn < m < msn]:
+            self._close_segment(open_msn)
+        self.part_lists.setdefault(msn, []).append(part)
+        self.parts[part.name] = part
+        self.bytes_held += len(part.data)
+        self.current_msn = msn
+        self.next_part = part.sequence + 1
+        self.max_part_duration = max(self.max_part_duration, part.duration)
+        if index == self.parts_per_segment - 1:
+            self._close_segment(msn)
+        self.updated_at = time.time()
+        self._playlists.clear()
+        self._changed.set()
+        self._changed = asyncio.Event()
+        if first and self._on_first_segment is not None:
+            self._on_first_segment()
+
+    def _close_segment(self, msn: int):
+        parts = self.part_lists[msn]
+        data = memoryview(b"".join(part.data for part in parts))
+        segment = Segment(f"segment_{msn:05d}.ts", msn, sum(part.duration for part in parts), data)
+        self.completed_msn = msn
+        if len(self.segments) == self.segments.maxlen:
+            evicted = self.segments.popleft()
+            self.by_name.pop(evicted.name, None)
+            self.bytes_held -= len(evicted.data)
+        self.segments.append(segment)
+        self.by_name[segment.name] = segment
+        self.bytes_held += len(data)
+        # Parts are only listed for the newest segments
+        while self.part_lists and next(iter(self.part_lists)) <= msn - PART_SEGMENTS:
+            _, dropped = self.part_lists.popitem(last=False)
+            for old in dropped:
+                self.parts.pop(old.name, None)
+                self.bytes_held -= len(old.data)
+
+    @property
+    def target_duration(self) -> int:
+        return max(
+            (math.ceil(s.duration) for s in self.segments),
+            default=math.ceil(self.part_target * self.parts_per_segment),
+        )
+
+    @property
+    def next_part_name(self) -> str:
+        return f"part_{self.next_part:05d}.ts"
+
+    def has_update(self, msn: int, part: Optional[int] = None) -> bool:
+        """
+        Whether the playlist contains segment `msn`, or with `part` that
+        part of it, as asked by _HLS_msn and _HLS_part.
+        """
+        if msn <= self.completed_msn:
+            return True
+        if part is None or msn != self.current_msn:
+            return False
+        return self.part_lists[msn][-1].sequence % self.parts_per_segment >= part
+
+    async def wait_until(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """Waits for `predicate` to hold after a part arrives; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def render_playlist(self, prefix: str = "") -> bytes:
+        """
+        LL-HLS media playlist: full segments, the parts of the newest ones
+        and the still open one, and a preload hint for the next part.
+        """
+        cached = self._playlists.get(prefix)
+        if cached is not None:
+            return cached
+
+        segments = list(self.segments)
+        first_msn = segments[0].sequence if segments else (self.current_msn or 0)
+        part_target = self.max_part_duration
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:6",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={part_target * 3:.3f}",
+            f"#EXT-X-PART-INF:PART-TARGET={part_target:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first_msn}",
+        ]
+
+        def add_parts(msn: int):
+            for part in self.part_lists.get(msn, ()):
+                line = f'#EXT-X-PART:DURATION={part.duration:.3f},URI="{prefix}{part.name}"'
+                if part.sequence % self.parts_per_segment == 0:
+                    # Segments start on a forced keyframe
+                    line += ",INDEPENDENT=YES"
+                lines.append(line)
+
+        for segment in segments:
+            add_parts(segment.sequence)
+            lines.append(f"#EXTINF:{segment.duration:.6f},")
+            lines.append(f"{prefix}{segment.name}")
+        if self.current_msn is not None and self.current_msn > self.completed_msn:
+            add_parts(self.current_msn)
+        lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{prefix}{self.next_part_name}"')
+        body = ("\n".join(lines) + "\n").encode()
+        self._playlists[prefix] = body
+        return body
+
+
+class MemoryOrigin:
+    """
+    In-memory HLS origin. FFmpeg uploads playlists and segments over
+    loopback HTTP and viewers are served straight from the per-channel rings.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.rings: Dict[str, SegmentRing] = {}
+        self.tokens: Dict[str, str] = {}
+
+    def open_channel(
+        self,
+        channel_name: str,
+        on_first_segment: Optional[Callable[[], None]] = None,
+        part_target: float = 0,
+        parts_per_segment: int = 1,
+    ) -> str:
+        """
+        Creates an empty ring and returns the upload token for the channel.
+        With `part_target` the channel is low-latency and uploads parts.
+        """
+        token = secrets.token_urlsafe(16)
+        if part_target > 0:
+            ring = PartialSegmentRing(self.capacity, part_target, parts_per_segment, on_first_segment)
+        else:
+            ring = SegmentRing(self.capacity, on_first_segment)
+        self.rings[channel_name] = ring
+        self.tokens[channel_name] = token
+        return token
+
+    def close_channel(self, channel_name: str):
+        self.rings.pop(channel_name, None)
+        self.tokens.pop(channel_name, None)
+
+    def ring(self, channel_name: str) -> Optional[SegmentRing]:
+        return self.rings.get(channel_name)
+
+    def check_token(self, channel_name: str, token: str) -> bool:
+        expected = self.tokens.get(channel_name)
+        return expected is not None and secrets.compare_digest(expected, token)
+
+    def ingest(self, channel_name: str, filename: str, body: memoryview):
+        ring = self.rings.get(channel_name)
+        if ring is None:
+            return
+        if filename.endswith(".m3u8"):
+            ring.put_playlist(body.tobytes())
+        elif filename.endswith(".ts"):
+            ring.put_segment(filename, body)
+
+
+class SegmentResponse(Response):
+    """Sends a segment's memoryview to the server without copying it into bytes."""
+
+    media_type = "video/mp2t"
+
+    def render(self, content) -> memoryview:
+        return content
+
+
+async def wait_for_playlist(ring: SegmentRing, msn: Optional[int], part: Optional[int] = None):
+    """
+    Blocking playlist reload: holds the request until the playlist has
+    segment `msn` (part `part`). Rings that are not low-latency do not
+    advertise blocking reloads and answer at once.
+    """
+    if msn is None or not isinstance(ring, PartialSegmentRing):
+        return
+    current = ring.current_msn if ring.current_msn is not None else -1
+    if msn > current + 2:
+        raise HTTPException(status_code=400, detail="_HLS_msn is too far in the future")
+    if not await ring.wait_until(lambda: ring.has_update(msn, part), ring.target_duration * 3):
+        raise HTTPException(status_code=503, detail="Requested segment did not arrive in time")
+
+
+def parse_media_playlist(body: bytes) -> List[Tuple[str, float]]:
+    """Returns (uri, duration) pairs from an HLS media playlist."""
+    entries = []
+    duration = None
+    for raw in body.decode("utf-8", "replace").splitlines():
+        line = raw.strip()
+        if line.startswith("#EXTINF:"):
+            try:
+                duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+            except ValueError:
+                duration = None
+        elif line and not line.startswith("#"):
+            if duration is not None:
+                entries.append((line.rsplit("/", 1)[-1], duration))
+            duration = None
+    return entries
+
+
+def segment_number(name: str) -> int:
+    match = SEGMENT_NUMBER.search(name)
+    return int(match.group(1)) if match else 0
+
+
+# Shared by the supervisor, which opens a ring per channel, and the /hls_streams routes
+memory_origin = MemoryOrigin(settings.HLS_MEMORY_SEGMENTS)
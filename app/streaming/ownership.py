@@ -0,0 +1,370 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from app.models.stream_lease import StreamLease
+
+
+def node_id() -> str:
+    """Identifies this worker process; the suffix tells apart a restart that reused the pid."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    """The right of one worker to run a channel's transcoder until `expires_at`."""
+
+    __slots__ = ("channel_name", "owner", "address", "expires_at", "viewed_at")
+
+    def __init__(
+        self,
+        channel_name: str,
+        owner: str,
+        address: str,
+        expires_at: float,
+        viewed_at: Optional[float] = None,
+    ):
+        self.channel_name = channel_name
+        self.owner = owner
+        # Public base URL of the owner, "" when it did not configure one
+        self.address = address
+        self.expires_at = expires_at
+        # Last viewer activity any worker reported for the channel
+        self.viewed_at = viewed_at
+
+    def as_dict(self) -> Dict:
+        return {
+            "owner": self.owner,
+            "address": self.address or None,
+            "expires_in": round(self.expires_at - time.time(), 1),
+            "viewed_at": self.viewed_at,
+        }
+
+
+class OwnershipRegistry(ABC):
+    """
+    Decides which worker runs each channel's FFmpeg. Leases are held by
+    acquiring them once and renewing them before `ttl` runs out; a lease
+    that is not renewed expires and any worker may take it over.
+    """
+
+    @abstractmethod
+    async def acquire(self, channel_name: str, owner: str, ttl: float, address: str = "") -> Lease:
+        """Takes the channel unless another owner holds a live lease; returns the holder's lease."""
+
+    @abstractmethod
+    async def renew(self, owner: str, channel_names: Iterable[str], ttl: float) -> Dict[str, Lease]:
+        """Extends `owner`'s leases; channels missing from the result were lost."""
+
+    @abstractmethod
+    async def release(self, channel_name: str, owner: str):
+        """Gives up the channel if `owner` still holds it."""
+
+    @abstractmethod
+    async def owners(self, channel_names: Iterable[str]) -> Dict[str, Lease]:
+        """Live leases of the given channels."""
+
+    @abstractmethod
+    async def touch(self, viewed: Dict[str, float]):
+        """Reports viewer activity seen by this worker to the channels' owners."""
+
+    @abstractmethod
+    async def leases(self) -> List[Lease]:
+        """Every live lease."""
+
+    async def close(self):
+        pass
+
+
+class LocalRegistry(OwnershipRegistry):
+    """Leases in this process only; enough for a single worker."""
+
+    def __init__(self):
+        self._leases: Dict[str, Lease] = {}
+
+    def _live(self, channel_name: str) -> Optional[Lease]:
+        lease = self._leases.get(channel_name)
+        return lease if lease is not None and lease.expires_at > time.time() else None
+
+    async def acquire(self, channel_name: str, owner: str, ttl: float, address: str = "") -> Lease:
+        lease = self._live(channel_name)
+        if lease is not None and lease.owner != owner:
+            return lease
+        viewed_at = lease.viewed_at if lease is not None else None
+        lease = self._leases[channel_name] = Lease(channel_name, owner, address, time.time() + ttl, viewed_at)
+        return lease
+
+    async def renew(self, owner: str, channel_names: Iterable[str], ttl: float) -> Dict[str, Lease]:
+        held = {}
+        for channel_name in channel_names:
+            lease = self._leases.get(channel_name)
+            if lease is not None and lease.owner == owner:
+                lease.expires_at = time.time() + ttl
+                held[channel_name] = lease
+        return held
+
+    async def release(self, channel_name: str, owner: str):
+        lease = self._leases.get(channel_name)
+        if lease is not None and lease.owner == owner:
+            del self._leases[channel_name]
+
+    async def owners(self, channel_names: Iterable[str]) -> Dict[str, Lease]:
+        live = {name: self._live(name) for name in channel_names}
+        return {name: lease for name, lease in live.items() if lease is not None}
+
+    async def touch(self, viewed: Dict[str, float]):
+        for channel_name, viewed_at in viewed.items():
+            lease = self._leases.get(channel_name)
+            if lease is not None and (lease.viewed_at is None or lease.viewed_at < viewed_at):
+                lease.viewed_at = viewed_at
+
+    async def leases(self) -> List[Lease]:
+        return [lease for lease in self._leases.values() if lease.expires_at > time.time()]
+
+
+def lease_from_row(row: StreamLease) -> Lease:
+    return Lease(row.re_stream_id, row.owner, row.address or "", row.expires_at, row.viewed_at)
+
+
+class DatabaseRegistry(OwnershipRegistry):
+    """
+    Leases in the stream_leases table. Every statement is a single
+    conditional UPDATE or INSERT, so SQLite serializes workers of one
+    node and a shared PostgreSQL serializes several nodes. Queries run
+    in the default executor.
+    """
+
+    def __init__(self, session_factory: Callable):
+        self.session_factory = session_factory
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def _acquire(self, channel_name: str, owner: str, ttl: float, address: str) -> Lease:
+        db = self.session_factory()
+        try:
+            now = time.time()
+            values = {"owner": owner, "address": address, "expires_at": now + ttl}
+            taken = db.query(StreamLease).filter(
+                StreamLease.re_stream_id == channel_name,
+                or_(StreamLease.owner == owner, StreamLease.expires_at <= now),
+            ).update(values, synchronize_session=False)
+            if not taken:
+                db.add(StreamLease(re_stream_id=channel_name, **values))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker inserted the channel's first lease first
+                db.rollback()
+            return lease_from_row(db.query(StreamLease).get(channel_name))
+        finally:
+            db.close()
+
+    def _renew(self, owner: str, channel_names: List[str], ttl: float) -> Dict[str, Lease]:
+        db = self.session_factory()
+        try:
+            held = db.query(StreamLease).filter(
+                StreamLease.owner == owner, StreamLease.re_stream_id.in_(channel_names)
+            )
+            held.update({"expires_at": time.time() + ttl}, synchronize_session=False)
+            db.commit()
+            return {row.re_stream_id: lease_from_row(row) for row in held.all()}
+        finally:
+            db.close()
+
+    def _release(self, channel_name: str, owner: str):
+        db = self.session_factory()
+        try:
+            db.query(StreamLease).filter(
+                StreamLease.re_stream_id == channel_name, StreamLease.owner == owner
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _owners(self, channel_names: Optional[List[str]]) -> Dict[str, Lease]:
+        db = self.session_factory()
+        try:
+            query = db.query(StreamLease).filter(StreamLease.expires_at > time.time())
+            if channel_names is not None:
+                query = query.filter(StreamLease.re_stream_id.in_(channel_names))
+            return {row.re_stream_id: lease_from_row(row) for row in query.all()}
+        finally:
+            db.close()
+
+    def _touch(self, viewed: Dict[str, float]):
+        db = self.session_factory()
+        try:
+            for channel_name, viewed_at in viewed.items():
+                db.query(StreamLease).filter(
+                    StreamLease.re_stream_id == channel_name,
+                    or_(StreamLease.viewed_at.is_(None), StreamLease.viewed_at < viewed_at),
+                ).update({"viewed_at": viewed_at}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def acquire(self, channel_name: str, owner: str, ttl: float, address: str = "") -> Lease:
+        return await self._run(self._acquire, channel_name, owner, ttl, address)
+
+    async def renew(self, owner: str, channel_names: Iterable[str], ttl: float) -> Dict[str, Lease]:
+        channel_names = list(channel_names)
+        if not channel_names:
+            return {}
+        return await self._run(self._renew, owner, channel_names, ttl)
+
+    async def release(self, channel_name: str, owner: str):
+        await self._run(self._release, channel_name, owner)
+
+    async def owners(self, channel_names: Iterable[str]) -> Dict[str, Lease]:
+        channel_names = list(channel_names)
+        if not channel_names:
+            return {}
+        return await self._run(self._owners, channel_names)
+
+    async def touch(self, viewed: Dict[str, float]):
+        if viewed:
+            await self._run(self._touch, viewed)
+
+    async def leases(self) -> List[Lease]:
+        return list((await self._run(self._owners, None)).values())
+
+
+# Lua keeps each compare-and-set atomic on the Redis server
+REDIS_ACQUIRE = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['owner'] ~= ARGV[1] then
+    return {current, redis.call('PTTL', KEYS[1])}
+end
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return {ARGV[2], tonumber(ARGV[3])}
+"""
+REDIS_RENEW = """
+local held = {}
+for i, key in ipairs(KEYS) do
+    local current = redis.call('GET', key)
+    if current and cjson.decode(current)['owner'] == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+        held[i] = current
+    else
+        held[i] = false
+    end
+end
+return held
+"""
+REDIS_RELEASE = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['owner'] == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisRegistry(OwnershipRegistry):
+    """
+    Leases as Redis keys that expire on their own, for nodes without a
+    shared database. Needs the redis package.
+    """
+
+    def __init__(self, url: str, prefix: str = "iptv:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError(
+                "STREAM_REGISTRY is a Redis URL but the redis package is not installed; run pip install 'redis>=4.2'"
+            )
+
+        self.redis = redis.from_url(url)
+        self.prefix = prefix
+        self._acquire = self.redis.register_script(REDIS_ACQUIRE)
+        self._renew = self.redis.register_script(REDIS_RENEW)
+        self._release = self.redis.register_script(REDIS_RELEASE)
+
+    def _key(self, channel_name: str) -> str:
+        return f"{self.prefix}lease:{channel_name}"
+
+    def _viewed_key(self, channel_name: str) -> str:
+        return f"{self.prefix}viewed:{channel_name}"
+
+    def _lease(self, channel_name: str, value: bytes, ttl_ms: int, viewed_at: Optional[bytes] = None) -> Lease:
+        data = json.loads(value)
+        return Lease(
+            channel_name, data["owner"], data["address"], time.time() + ttl_ms / 1000,
+            float(viewed_at) if viewed_at is not None else None,
+        )
+
+    async def acquire(self, channel_name: str, owner: str, ttl: float, address: str = "") -> Lease:
+        value = json.dumps({"owner": owner, "address": address})
+        current, ttl_ms = await self._acquire(keys=[self._key(channel_name)], args=[owner, value, int(ttl * 1000)])
+        return self._lease(channel_name, current, ttl_ms)
+
+    async def renew(self, owner: str, channel_names: Iterable[str], ttl: float) -> Dict[str, Lease]:
+        channel_names = list(channel_names)
+        if not channel_names:
+            return {}
+        values = await self._renew(keys=[self._key(name) for name in channel_names], args=[owner, int(ttl * 1000)])
+        viewed = await self.redis.mget([self._viewed_key(name) for name in channel_names])
+        return {
+            name: self._lease(name, value, int(ttl * 1000), viewed_at)
+            for name, value, viewed_at in zip(channel_names, values, viewed)
+            if value
+        }
+
+    async def release(self, channel_name: str, owner: str):
+        await self._release(keys=[self._key(channel_name)], args=[owner])
+
+    async def owners(self, channel_names: Iterable[str]) -> Dict[str, Lease]:
+        channel_names = list(channel_names)
+        if not channel_names:
+            return {}
+        pipe = self.redis.pipeline()
+        for name in channel_names:
+            pipe.get(self._key(name))
+            pipe.pttl(self._key(name))
+        replies = await pipe.execute()
+        return {
+            name: self._lease(name, value, ttl_ms)
+            for name, value, ttl_ms in zip(channel_names, replies[::2], replies[1::2])
+            if value and ttl_ms > 0
+        }
+
+    async def touch(self, viewed: Dict[str, float]):
+        if not viewed:
+            return
+        pipe = self.redis.pipeline()
+        for channel_name, viewed_at in viewed.items():
+            # Forgotten a while after nobody watches any more
+            pipe.set(self._viewed_key(channel_name), viewed_at, ex=3600)
+        await pipe.execute()
+
+    async def leases(self) -> List[Lease]:
+        names = [
+            key.decode()[len(self._key("")):]
+            async for key in self.redis.scan_iter(match=self._key("*"))
+        ]
+        return list((await self.owners(names)).values())
+
+    async def close(self):
+        await self.redis.close()
+
+
+def create_registry(spec: str, session_factory: Callable) -> OwnershipRegistry:
+    """
+    Registry from the STREAM_REGISTRY setting: "local", "database", or
+    a redis:// URL.
+    """
+    if spec == "local":
+        return LocalRegistry()
+    if spec == "database":
+        return DatabaseRegistry(session_factory)
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisRegistry(spec)
+    raise ValueError(f"Unknown STREAM_REGISTRY '{spec}'")
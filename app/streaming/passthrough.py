@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import hmac
+import posixpath
+import re
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from app.core import metrics
+from app.streaming.resource_cache import Resource, ResourceCache
+
+PASSTHROUGH_HEADERS = {"User-Agent": "VLC/3.0.0"}
+URI_ATTRIBUTE = re.compile(r'URI="([^"]+)"')
+# Larger responses are not playlists; a live TS URL would never end
+MAX_PLAYLIST_BYTES = 1024 * 1024
+# Tags whose presence makes a playlist a master playlist
+MASTER_TAGS = ("#EXT-X-STREAM-INF", "#EXT-X-MEDIA:", "#EXT-X-I-FRAME-STREAM-INF")
+
+
+class UpstreamError(Exception):
+    """Raised when the upstream answers with an error or cannot be reached."""
+
+
+class HlsPassthrough:
+    """
+    Serves upstream HLS channels without FFmpeg. Playlists and segments are
+    fetched over one pooled keep-alive client; playlist URIs are rewritten
+    to signed URLs under `prefix`, so viewers fetch everything through us
+    and a segment is downloaded once for all of them.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        secret: str,
+        timeout: float = 10,
+        max_connections: int = 100,
+        playlist_ttl: float = 1,
+        segment_ttl: float = 60,
+        cache_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.prefix = prefix.rstrip("/")
+        self.secret = secret.encode()
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.playlist_ttl = playlist_ttl
+        self.segment_ttl = segment_ttl
+        self.cache = ResourceCache(cache_bytes)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, limits=limits, follow_redirects=True, headers=PASSTHROUGH_HEADERS
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _signature(self, channel_name: str, url: str) -> str:
+        digest = hmac.new(self.secret, f"{channel_name}\n{url}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:12]).decode()
+
+    def resource_url(self, channel_name: str, url: str, playlist: bool) -> str:
+        """Signed URL under `prefix` that serves the upstream `url`."""
+        encoded = base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+        if playlist:
+            extension = ".m3u8"
+        else:
+            extension = posixpath.splitext(urlparse(url).path)[1] or ".ts"
+        return f"{self.prefix}/{channel_name}/{self._signature(channel_name, url)}/{encoded}{extension}"
+
+    def resolve(self, channel_name: str, signature: str, name: str) -> Tuple[str, bool]:
+        """
+        Upstream URL of a rewritten resource and whether it is a playlist.
+        Raises ValueError when the signature does not match, so clients
+        cannot make the server fetch arbitrary URLs.
+        """
+        encoded, extension = posixpath.splitext(name)
+        try:
+            url = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError("Malformed resource name")
+        if not hmac.compare_digest(signature, self._signature(channel_name, url)):
+            raise ValueError("Invalid resource signature")
+        return url, extension == ".m3u8"
+
+    async def _fetch(self, url: str, ttl: float, limit: Optional[int] = None) -> Resource:
+        """Downloads `url`; bodies over `limit` bytes are refused."""
+        started = time.perf_counter()
+        try:
+            async with self.client.stream("GET", url) as response:
+                if response.status_code != 200:
+                    raise UpstreamError(f"HTTP {response.status_code}")
+                data = bytearray()
+                async for chunk in response.aiter_bytes():
+                    data += chunk
+                    if limit is not None and len(data) > limit:
+                        raise UpstreamError("Upstream response is too large for a playlist")
+                resource = Resource(
+                    str(response.url),
+                    bytes(data),
+                    response.headers.get("content-type", "application/octet-stream"),
+                    time.monotonic() + ttl,
+                )
+        except UpstreamError:
+            metrics.passthrough_fetches.inc(result="error")
+            raise
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            metrics.passthrough_fetches.inc(result="error")
+            raise UpstreamError(f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+        metrics.passthrough_fetches.inc(result="ok")
+        metrics.passthrough_fetch_seconds.observe(time.perf_counter() - started)
+        return resource
+
+    def rewrite_playlist(self, channel_name: str, body: bytes, base_url: str) -> bytes:
+        """
+        Points every URI of an upstream playlist at our server. URIs of a
+        master playlist are playlists themselves, those of a media
+        playlist are segments, keys and init sections.
+        """
+        text = body.decode("utf-8", "replace")
+        playlist = any(tag in text for tag in MASTER_TAGS)
+
+        def rewrite(uri: str) -> str:
+            return self.resource_url(channel_name, urljoin(base_url, uri), playlist)
+
+        lines = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped and not stripped.startswith("#"):
+                line = rewrite(stripped)
+            elif stripped.startswith("#") and 'URI="' in stripped:
+                line = URI_ATTRIBUTE.sub(lambda m: f'URI="{rewrite(m.group(1))}"', stripped)
+            lines.append(line)
+        return ("\n".join(lines) + "\n").encode()
+
+    async def playlist(self, channel_name: str, url: str) -> bytes:
+        """
+        The rewritten upstream playlist at `url`. It is cached for
+        `playlist_ttl` seconds, so polling viewers share one upstream fetch.
+        """
+        async def fetch() -> Resource:
+            resource = await self._fetch(url, self.playlist_ttl, MAX_PLAYLIST_BYTES)
+            if not resource.data.lstrip().startswith(b"#EXTM3U"):
+                raise UpstreamError("Upstream did not return an HLS playlist")
+            resource.data = self.rewrite_playlist(channel_name, resource.data, resource.url)
+            return resource
+
+        resource = await self.cache.get_or_fetch(f"{channel_name}\n{url}", fetch)
+        return resource.data
+
+    async def segment(self, url: str) -> Resource:
+        """An upstream segment, downloaded once and shared for `segment_ttl` seconds."""
+        return await self.cache.get_or_fetch(url, lambda: self._fetch(url, self.segment_ttl))
+
+    def as_dict(self) -> Dict:
+        return {
+            "cached_bytes": self.cache.bytes_held,
+            "cached_entries": len(self.cache._entries),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+        }
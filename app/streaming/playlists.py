@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+class RenderedPlaylist:
+    """Encoded playlist bytes plus their ETag and compressed copies."""
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.encoded: Dict[str, bytes] = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.encoded["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(body)
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        # Every representation needs its own strong ETag
+        return self.etag if encoding is None else self.etag[:-1] + "-" + encoding + '"'
+
+
+class PlaylistCache:
+    """
+    Renders each registered playlist variant once per catalog version and
+    keeps the bytes until the channel set changes. `generation` reports the
+    catalog's invalidation count; a render that saw it change is not kept.
+    """
+
+    def __init__(self, source: Callable[[], List[dict]], generation: Callable[[], int] = lambda: 0):
+        self.source = source
+        self.generation = generation
+        self.version = 0
+        self._lock = threading.Lock()
+        self._renderers: Dict[str, Callable[[List[dict]], str]] = {}
+        self._media_types: Dict[str, str] = {}
+        self._rendered: Dict[str, RenderedPlaylist] = {}
+
+    def register(self, name: str, media_type: str = "audio/x-mpegurl; charset=utf-8"):
+        """Decorator that registers a function rendering a playlist from the channel list."""
+        def decorator(render: Callable[[List[dict]], str]):
+            self._renderers[name] = render
+            self._media_types[name] = media_type
+            return render
+        return decorator
+
+    def invalidate(self):
+        """Drops every rendered variant; call whenever the channel set changes."""
+        with self._lock:
+            self.version += 1
+            self._rendered.clear()
+
+    def get(self, name: str) -> RenderedPlaylist:
+        with self._lock:
+            rendered = self._rendered.get(name)
+            version = self.version
+        if rendered is None:
+            generation = self.generation()
+            body = self._renderers[name](self.source()).encode("utf-8")
+            rendered = RenderedPlaylist(body, self._media_types[name])
+            # The catalog may have changed while rendering; serve this copy but do not keep it
+            with self._lock:
+                if self.version == version and self.generation() == generation:
+                    self._rendered[name] = rendered
+        return rendered
+
+
+def playlist_response(request: Request, rendered: RenderedPlaylist, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serves a rendered playlist, answering If-None-Match with 304 and picking
+    a precompressed copy when the client accepts one.
+    """
+    encoding = _pick_encoding(request.headers.get("accept-encoding", ""), rendered.encoded)
+    etag = rendered.etag_for(encoding)
+    response_headers = dict(headers or {})
+    response_headers["ETag"] = etag
+    response_headers["Vary"] = "Accept-Encoding"
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=response_headers)
+
+    body = rendered.body
+    if encoding is not None:
+        body = rendered.encoded[encoding]
+        response_headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=rendered.media_type, headers=response_headers)
+
+
+def overlay_response(request: Request, rendered: RenderedPlaylist, overlay: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serves a rendered playlist with per-request entries inserted after its
+    header line. The shared body is reused as is; only the overlay is new.
+    """
+    if not overlay:
+        return playlist_response(request, rendered, headers)
+
+    etag = rendered.etag[:-1] + "-" + hashlib.sha1(overlay).hexdigest()[:16] + '"'
+    response_headers = dict(headers or {})
+    response_headers["ETag"] = etag
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=response_headers)
+
+    header_end = rendered.body.find(b"\n") + 1
+    body = rendered.body[:header_end] + overlay + rendered.body[header_end:]
+    return Response(content=body, media_type=rendered.media_type, headers=response_headers)
+
+
+def _pick_encoding(accept_encoding: str, available: Iterable[str]) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(token.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header lists `etag` (weakly compared) or is "*"."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
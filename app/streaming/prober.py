@@ -0,0 +1,263 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import httpx
+
+from app.core import metrics
+from app.db.repositories.channel import channel_cache, channel_health_cache, save_channel_health
+from app.db.session import SessionLocal
+
+PROBE_HEADERS = {"User-Agent": "VLC/3.0.0"}
+# Playlists larger than this are not HLS playlists worth parsing
+MAX_PLAYLIST_BYTES = 1024 * 1024
+# Results stored per transaction during a sweep
+SAVE_BATCH_SIZE = 200
+
+
+def parse_playlist_uris(body: bytes) -> Tuple[List[str], List[str]]:
+    """Variant stream URIs and segment URIs listed in an HLS playlist."""
+    variants, segments = [], []
+    stream_inf = False
+    for raw in body.decode("utf-8", "replace").splitlines():
+        line = raw.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            stream_inf = True
+        elif line and not line.startswith("#"):
+            (variants if stream_inf else segments).append(line)
+            stream_inf = False
+    return variants, segments
+
+
+def _new_result(channel: dict) -> dict:
+    return {
+        "re_stream_id": channel["re_stream_id"],
+        "ok": False,
+        "status_code": None,
+        "error": None,
+        "ttfb_ms": None,
+        "throughput_kbps": None,
+        "checked_at": datetime.utcnow(),
+    }
+
+
+async def _read_up_to(chunks: AsyncIterator[bytes], limit: int) -> bytes:
+    """Reads from a response's chunk iterator until `limit` bytes or the end; can be resumed."""
+    data = b""
+    async for chunk in chunks:
+        data += chunk
+        if len(data) >= limit:
+            break
+    return data
+
+
+async def _fetch_playlist(client: httpx.AsyncClient, url: str) -> Tuple[httpx.Response, bytes]:
+    async with client.stream("GET", url) as response:
+        return response, await _read_up_to(response.aiter_bytes(), MAX_PLAYLIST_BYTES)
+
+
+async def _measure_throughput(chunks: AsyncIterator[bytes], received: int, limit: int) -> float:
+    """Reads a media response until `limit` bytes in total; returns kbit/s."""
+    started = time.perf_counter()
+    async for chunk in chunks:
+        if received >= limit:
+            break
+        received += len(chunk)
+    elapsed = max(time.perf_counter() - started, 0.001)
+    return round(received * 8 / 1000 / elapsed, 1)
+
+
+async def probe_channel(client: httpx.AsyncClient, channel: dict, segment_bytes: int) -> dict:
+    """
+    Fetches a channel's URL and, for HLS, its media playlist and newest
+    segment. Records the time to first byte of the channel URL and the
+    rate at which the segment downloads.
+    """
+    result = _new_result(channel)
+    started = time.perf_counter()
+    try:
+        async with client.stream("GET", channel["url"]) as response:
+            result["ttfb_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result["status_code"] = response.status_code
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            chunks = response.aiter_bytes()
+            first = await _read_up_to(chunks, 7)
+            if not first.startswith(b"#EXTM3U"):
+                # A plain MPEG-TS or HTTP stream: the response itself is the media
+                result["throughput_kbps"] = await _measure_throughput(chunks, len(first), segment_bytes)
+                result["ok"] = True
+                return result
+            body = first + await _read_up_to(chunks, MAX_PLAYLIST_BYTES)
+            playlist_url = str(response.url)
+
+        variants, segments = parse_playlist_uris(body)
+        if variants:
+            playlist_url = urljoin(playlist_url, variants[0])
+            response, body = await _fetch_playlist(client, playlist_url)
+            if response.status_code != 200:
+                result["error"] = f"Variant playlist HTTP {response.status_code}"
+                return result
+            _, segments = parse_playlist_uris(body)
+        if not segments:
+            result["error"] = "Playlist lists no segments"
+            return result
+
+        async with client.stream("GET", urljoin(playlist_url, segments[-1])) as response:
+            if response.status_code != 200:
+                result["error"] = f"Segment HTTP {response.status_code}"
+                return result
+            result["throughput_kbps"] = await _measure_throughput(response.aiter_bytes(), 0, segment_bytes)
+        result["ok"] = True
+    except httpx.TimeoutException:
+        result["error"] = "Timeout"
+    except (httpx.HTTPError, httpx.InvalidURL) as e:
+        result["error"] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+    return result
+
+
+async def probe_channels(
+    channels: Iterable[dict],
+    on_result: Callable[[dict], Awaitable[None]],
+    concurrency: int = 50,
+    timeout: float = 10,
+    segment_bytes: int = 512 * 1024,
+):
+    """
+    Probes channels `concurrency` at a time over one pooled HTTP client,
+    so connections to the same provider are reused across channels.
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    pending = iter(channels)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits, follow_redirects=True, headers=PROBE_HEADERS) as client:
+        async def worker():
+            # Workers share one iterator; next() never runs concurrently in the event loop
+            for channel in pending:
+                try:
+                    # Each request has `timeout`; a probe makes at most three of them
+                    result = await asyncio.wait_for(probe_channel(client, channel, segment_bytes), timeout * 3)
+                except asyncio.TimeoutError:
+                    result = _new_result(channel)
+                    result["error"] = "Timeout"
+                metrics.channel_probes.inc(result="ok" if result["ok"] else "failed")
+                if result["ttfb_ms"] is not None:
+                    metrics.channel_probe_ttfb.observe(result["ttfb_ms"] / 1000)
+                await on_result(result)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+
+class ChannelProber:
+    """
+    Probes every catalog channel and stores the results in channel_health,
+    once on request or every `interval` seconds in the background.
+    """
+
+    def __init__(self, concurrency: int, timeout: float, segment_bytes: int, interval: float = 0):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.segment_bytes = segment_bytes
+        self.interval = interval
+        self.last_sweep: Optional[dict] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._sweep_task is not None and not self._sweep_task.done()
+
+    async def sweep(
+        self,
+        channels: Optional[List[dict]] = None,
+        on_result: Optional[Callable[[dict], None]] = None,
+        save: bool = True,
+    ) -> dict:
+        """
+        Probes `channels` (the whole catalog by default) and returns a summary.
+        Results are saved in batches from a worker thread while probing goes on.
+        """
+        loop = asyncio.get_running_loop()
+        if channels is None:
+            channels = await loop.run_in_executor(None, channel_cache.all)
+        batch: List[dict] = []
+        save_lock = asyncio.Lock()
+        counts = {"ok": 0, "failed": 0}
+        started = time.perf_counter()
+
+        async def flush():
+            rows = batch[:]
+            batch.clear()
+            if rows:
+                async with save_lock:
+                    await loop.run_in_executor(None, _save, rows)
+
+        async def collect(result: dict):
+            counts["ok" if result["ok"] else "failed"] += 1
+            if on_result is not None:
+                on_result(result)
+            if save:
+                batch.append(result)
+                if len(batch) >= SAVE_BATCH_SIZE:
+                    await flush()
+
+        try:
+            await probe_channels(channels, collect, self.concurrency, self.timeout, self.segment_bytes)
+        finally:
+            if save:
+                await flush()
+                channel_health_cache.notify()
+
+        seconds = time.perf_counter() - started
+        summary = {
+            "probed": counts["ok"] + counts["failed"],
+            "ok": counts["ok"],
+            "failed": counts["failed"],
+            "seconds": round(seconds, 2),
+            "finished_at": datetime.utcnow(),
+        }
+        self.last_sweep = summary
+        return summary
+
+    def start_sweep(self) -> bool:
+        """Starts a sweep in the background; False when one is already running."""
+        if self.running:
+            return False
+        self._sweep_task = asyncio.create_task(self.sweep())
+        return True
+
+    def start(self):
+        """Runs a sweep every `interval` seconds; must run inside the event loop."""
+        if self.interval > 0 and self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._sweep_forever())
+
+    async def close(self):
+        for task in (self._loop_task, self._sweep_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._loop_task = self._sweep_task = None
+
+    async def _sweep_forever(self):
+        while True:
+            if self.start_sweep():
+                try:
+                    summary = await self._sweep_task
+                    print(f"Probed {summary['probed']} channels, {summary['failed']} failing ({summary['seconds']}s)")
+                except Exception as e:
+                    print(f"Channel probe sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+def _save(rows: List[dict]):
+    db = SessionLocal()
+    try:
+        save_channel_health(db, rows)
+    finally:
+        db.close()
@@ -0,0 +1,134 @@
+import os
+import time
+from typing import Dict, Optional
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    """Parses FFmpeg progress numbers such as "25.00", "1.01x" or "2048.0kbits/s"."""
+    if value is None:
+        return None
+    value = value.strip()
+    for suffix in ("kbits/s", "x"):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None  # "N/A"
+
+
+class StreamProgress:
+    """
+    Live telemetry of one FFmpeg process, parsed from `-progress pipe:1`.
+    FFmpeg writes a block of key=value lines every half second, closed by
+    a `progress=continue` (or `progress=end`) line.
+    """
+
+    def __init__(self):
+        self._block: Dict[str, str] = {}
+        self.frame: Optional[int] = None
+        self.fps: Optional[float] = None
+        self.bitrate_kbps: Optional[float] = None
+        self.speed: Optional[float] = None
+        self.drop_frames = 0
+        self.dup_frames = 0
+        self.out_time_us: Optional[int] = None
+        self.out_time: Optional[str] = None
+        self.blocks = 0
+        self.updated_at: Optional[float] = None
+        # When out_time last moved forward, and since when speed has been too low
+        self.advanced_at: Optional[float] = None
+        self.slow_since: Optional[float] = None
+
+    def feed(self, line: str, min_speed: float = 0) -> bool:
+        """Consumes one output line; returns True when it completed a block."""
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return False
+        if key != "progress":
+            self._block[key] = value
+            return False
+        self._apply(self._block, min_speed)
+        self._block = {}
+        return True
+
+    def _apply(self, block: Dict[str, str], min_speed: float):
+        now = time.time()
+        self.blocks += 1
+        self.updated_at = now
+        frame = _float(block.get("frame"))
+        self.frame = int(frame) if frame is not None else self.frame
+        self.fps = _float(block.get("fps"))
+        self.bitrate_kbps = _float(block.get("bitrate"))
+        self.speed = _float(block.get("speed"))
+        self.drop_frames = int(_float(block.get("drop_frames")) or 0)
+        self.dup_frames = int(_float(block.get("dup_frames")) or 0)
+        self.out_time = block.get("out_time", self.out_time)
+
+        out_time_us = _float(block.get("out_time_us") or block.get("out_time_ms"))
+        if out_time_us is not None and (self.out_time_us is None or out_time_us > self.out_time_us):
+            self.out_time_us = int(out_time_us)
+            self.advanced_at = now
+
+        if self.speed is not None and self.speed < min_speed:
+            self.slow_since = self.slow_since or now
+        else:
+            self.slow_since = None
+
+    def stalled_for(self, since: float) -> float:
+        """Seconds the output clock has not moved, counted from `since` before the first advance."""
+        return time.time() - (self.advanced_at or since)
+
+    def score(self, since: float) -> int:
+        """
+        0-100 health estimate: 100 when the output clock runs at real time
+        without dropped frames.
+        """
+        score = 100.0
+        stalled = self.stalled_for(since)
+        if stalled > 2:
+            score -= min(60, stalled * 6)
+        if self.speed is not None and self.speed < 1:
+            score -= min(30, (1 - self.speed) * 100)
+        if self.frame:
+            score -= min(20, self.drop_frames / self.frame * 200)
+        return max(0, int(score))
+
+    def as_dict(self, since: float) -> Dict:
+        return {
+            "health": self.score(since),
+            "fps": self.fps,
+            "bitrate_kbps": self.bitrate_kbps,
+            "speed": self.speed,
+            "frame": self.frame,
+            "drop_frames": self.drop_frames,
+            "dup_frames": self.dup_frames,
+            "out_time": self.out_time,
+            "stalled_seconds": round(self.stalled_for(since), 1),
+            "updated_at": self.updated_at,
+        }
+
+
+class ProcessCpu:
+    """CPU use of a child process in percent of one core, from /proc/<pid>/stat (Linux)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.percent: Optional[float] = None
+        self._last: Optional[tuple] = None
+
+    def sample(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                # Fields after the parenthesised command name; utime and stime are 14th and 15th
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            return self.percent
+        ticks = int(fields[11]) + int(fields[12])
+        now = time.monotonic()
+        if self._last is not None and now > self._last[1]:
+            self.percent = round((ticks - self._last[0]) / CLOCK_TICKS / (now - self._last[1]) * 100, 1)
+        self._last = (ticks, now)
+        return self.percent
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from app.core import metrics
+
+RELAY_HEADERS = {"User-Agent": "VLC/3.0.0"}
+
+
+def is_playlist_url(url: str) -> bool:
+    """HLS playlists are short documents, not byte streams worth relaying."""
+    return urlparse(url).path.lower().endswith((".m3u8", ".m3u"))
+
+
+class RelayClient:
+    """One downstream connection of a channel relay, fed through a bounded queue."""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.bytes_sent = 0
+        self.dropped = False
+        self.connected_at = time.time()
+
+    def feed(self, chunk: bytes) -> bool:
+        """Queues a chunk; False when the client is too far behind to take it."""
+        try:
+            self.queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def close(self):
+        """Discards what is still queued and ends the client's stream."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+
+class ChannelRelay:
+    """
+    One upstream connection of a channel, copied to every client. A client
+    whose queue is full is dropped so it cannot stall the others.
+    """
+
+    def __init__(self, hub: "RelayHub", channel_name: str, url: str):
+        self.hub = hub
+        self.channel_name = channel_name
+        self.url = url
+        self.clients: Set[RelayClient] = set()
+        # Set once the upstream answered, or failed to
+        self.connected = asyncio.Event()
+        self.status_code: Optional[int] = None
+        self.content_type = "video/mp2t"
+        self.error: Optional[str] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.started_at = time.time()
+        self.closed = False
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._task = asyncio.create_task(self._pump())
+
+    def add_client(self) -> RelayClient:
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        client = RelayClient(self.hub.queue_size)
+        self.clients.add(client)
+        return client
+
+    def remove_client(self, client: RelayClient):
+        if client not in self.clients:
+            return
+        self.clients.discard(client)
+        self.bytes_out += client.bytes_sent
+        metrics.relay_bytes.inc(client.bytes_sent, channel=self.channel_name, direction="downstream")
+        if not self.clients and not self.closed:
+            # Keep the upstream open for a moment; players reconnect when switching or seeking
+            self._idle_handle = asyncio.get_running_loop().call_later(self.hub.idle_grace, self._close_if_idle)
+
+    def _close_if_idle(self):
+        self._idle_handle = None
+        if not self.clients:
+            self._task.cancel()
+
+    def _drop(self, client: RelayClient):
+        client.dropped = True
+        client.close()
+        self.dropped += 1
+        metrics.relay_clients_dropped.inc(channel=self.channel_name)
+        print(f"Dropped a slow relay client of '{self.channel_name}'")
+        self.remove_client(client)
+
+    async def _pump(self):
+        try:
+            async with httpx.AsyncClient(
+                timeout=self.hub.timeout, follow_redirects=True, headers=RELAY_HEADERS
+            ) as client:
+                async with client.stream("GET", self.url) as response:
+                    self.status_code = response.status_code
+                    self.content_type = response.headers.get("content-type", self.content_type)
+                    self.connected.set()
+                    if response.status_code != 200:
+                        self.error = f"HTTP {response.status_code}"
+                        return
+                    print(f"Relay for '{self.channel_name}' connected upstream")
+                    async for chunk in response.aiter_raw():
+                        self.bytes_in += len(chunk)
+                        metrics.relay_bytes.inc(len(chunk), channel=self.channel_name, direction="upstream")
+                        for relay_client in list(self.clients):
+                            if not relay_client.feed(chunk):
+                                self._drop(relay_client)
+                    self.error = "Upstream ended the stream"
+        except httpx.TimeoutException:
+            self.error = "Upstream timed out"
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            self.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        finally:
+            self.closed = True
+            self.connected.set()
+            for relay_client in list(self.clients):
+                relay_client.close()
+            self.hub.relay_closed(self)
+            print(f"Relay for '{self.channel_name}' closed: {self.error or 'no clients left'}")
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def as_dict(self) -> Dict:
+        return {
+            "clients": len(self.clients),
+            "upstream_status": self.status_code,
+            "upstream_bytes": self.bytes_in,
+            "downstream_bytes": self.bytes_out + sum(c.bytes_sent for c in self.clients),
+            "dropped_clients": self.dropped,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+        }
+
+
+class RelayHub:
+    """Shares one upstream connection per channel between all /proxy clients."""
+
+    def __init__(self, queue_size: int, idle_grace: float, timeout: float):
+        self.queue_size = queue_size
+        self.idle_grace = idle_grace
+        self.timeout = timeout
+        self.relays: Dict[str, ChannelRelay] = {}
+
+    async def subscribe(self, channel_name: str, url: str) -> Tuple[ChannelRelay, RelayClient]:
+        """
+        Joins the channel's relay, opening the upstream connection if this
+        is the first client, and waits until the upstream has answered.
+        """
+        relay = self.relays.get(channel_name)
+        if relay is None or relay.closed:
+            relay = self.relays[channel_name] = ChannelRelay(self, channel_name, url)
+        client = relay.add_client()
+        try:
+            await relay.connected.wait()
+        except BaseException:
+            # The viewer went away before the upstream answered
+            relay.remove_client(client)
+            raise
+        return relay, client
+
+    def relay_closed(self, relay: ChannelRelay):
+        if self.relays.get(relay.channel_name) is relay:
+            del self.relays[relay.channel_name]
+
+    def status(self, channel_name: str) -> Optional[Dict]:
+        relay = self.relays.get(channel_name)
+        return relay.as_dict() if relay is not None else None
+
+    async def close(self):
+        await asyncio.gather(*(relay.close() for relay in list(self.relays.values())))
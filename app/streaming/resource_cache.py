@@ -0,0 +1,76 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class Resource:
+    """A response body kept in a ResourceCache."""
+
+    __slots__ = ("url", "data", "content_type", "expires_at")
+
+    def __init__(self, url: str, data: bytes, content_type: str, expires_at: float):
+        # Where the body came from; for upstream responses the final URL after redirects
+        self.url = url
+        self.data = data
+        self.content_type = content_type
+        self.expires_at = expires_at
+
+
+class ResourceCache:
+    """
+    Short-lived, byte-bounded LRU cache of response bodies, shared by the
+    pass-through channels and the disk origin. Concurrent misses for the
+    same key share one fetch.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Resource]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def get(self, key: str) -> Optional[Resource]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: Resource):
+        if key in self._entries:
+            self._remove(key)
+        if len(entry.data) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.bytes_held += len(entry.data)
+        while self.bytes_held > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        self.bytes_held -= len(self._entries.pop(key).data)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Resource]]) -> Resource:
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            # A task of its own, so a viewer disconnecting does not cancel the others' fetch
+            task = self._inflight[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda t: self._fetched(key, t))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def _fetched(self, key: str, task: asyncio.Task):
+        del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
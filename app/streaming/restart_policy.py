@@ -0,0 +1,120 @@
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# An open circuit waits at most this many times the base cooldown
+MAX_COOLDOWN_FACTOR = 8
+
+
+class RestartPolicy:
+    """
+    Decides when a failed channel is started again.
+
+    Consecutive failures are retried after an exponentially growing delay
+    with random jitter. `threshold` failures within `window` seconds open
+    the circuit: the channel stays stopped for `cooldown` seconds, after
+    which one half-open attempt either closes the circuit (the stream
+    becomes ready) or opens it again for twice as long.
+    """
+
+    def __init__(
+        self,
+        base_delay: float,
+        max_delay: float,
+        jitter: float,
+        threshold: int,
+        window: float,
+        cooldown: float,
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = deque()
+        # Failures since the channel last stayed up for a whole window
+        self.attempt = 0
+        # Times the circuit opened without a successful probe in between
+        self.trips = 0
+        self.next_start_at: Optional[float] = None
+        self.last_failure: Optional[str] = None
+        self.last_failure_at: Optional[float] = None
+
+    def _prune(self, now: float):
+        while self.failures and self.failures[0] < now - self.window:
+            self.failures.popleft()
+
+    def record_failure(self, reason: str, uptime: float) -> Optional[float]:
+        """
+        Records a crash or stall after `uptime` seconds of running. Returns
+        the delay before the next attempt, or None when the circuit opened.
+        """
+        now = time.time()
+        if uptime >= self.window:
+            self.attempt = 0
+        self.failures.append(now)
+        self._prune(now)
+        self.last_failure = reason
+        self.last_failure_at = now
+
+        if self.state == HALF_OPEN or (self.threshold and len(self.failures) >= self.threshold):
+            cooldown = min(self.cooldown * 2 ** self.trips, self.cooldown * MAX_COOLDOWN_FACTOR)
+            self.state = OPEN
+            self.trips += 1
+            self.failures.clear()
+            self.next_start_at = now + cooldown
+            return None
+
+        delay = min(self.max_delay, self.base_delay * 2 ** self.attempt)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.attempt += 1
+        self.next_start_at = now + delay
+        return delay
+
+    def record_success(self):
+        """The channel produced its first segment; a half-open probe closes the circuit."""
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self.trips = 0
+            self.attempt = 0
+        self.next_start_at = None
+
+    def retry_after(self) -> float:
+        """Seconds until the channel may be started again, 0 when it may start now."""
+        if self.next_start_at is None:
+            return 0
+        return max(0.0, self.next_start_at - time.time())
+
+    def allow_start(self, scheduled: bool = False) -> bool:
+        """
+        Whether a new process may start now. `scheduled` starts are the
+        supervisor's own retries, due when their delay has passed. The
+        first start of an open circuit is its half-open probe.
+        """
+        if not scheduled and self.retry_after() > 0:
+            return False
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+        return True
+
+    def as_dict(self) -> Dict:
+        now = time.time()
+        self._prune(now)
+        retry_after = self.retry_after()
+        return {
+            "state": self.state,
+            "recent_failures": len(self.failures),
+            "failure_threshold": self.threshold or None,
+            "consecutive_failures": self.attempt,
+            "trips": self.trips,
+            "retry_in_seconds": round(retry_after, 1) if retry_after else None,
+            "last_failure": self.last_failure,
+            "last_failure_at": self.last_failure_at,
+        }
@@ -0,0 +1,94 @@
+import os
+from typing import IO, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(st: os.stat_result) -> str:
+    """Strong ETag of a finished file; FFmpeg never rewrites a closed segment."""
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def open_segment(path: str) -> Tuple[IO[bytes], os.stat_result]:
+    """Opens a segment and stats the open file. Blocks; run it in the threadpool."""
+    f = open(path, "rb")
+    try:
+        return f, os.fstat(f.fileno())
+    except OSError:
+        f.close()
+        raise
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    First byte and length of a single "bytes=" range, or None to send the
+    whole file (no header, or a multi-range the client gets in full).
+    Raises ValueError when the range lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = min(int(end), size)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            return size - length, length
+        first = int(start)
+        last = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        raise ValueError("Malformed range")
+    if first >= size or last < first:
+        raise ValueError("Range not satisfiable")
+    return first, last - first + 1
+
+
+class SegmentFileResponse(Response):
+    """
+    Sends `length` bytes of an open file from `offset`. Uses the ASGI
+    zero-copy send extension when the server offers it (sendfile),
+    otherwise reads chunks from a worker thread.
+    """
+
+    def __init__(self, file: IO[bytes], offset: int, length: int, status_code: int = 200, headers: Optional[dict] = None):
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.status_code = status_code
+        self.media_type = "video/mp2t"
+        self.background = None
+        headers = dict(headers or {})
+        headers["content-length"] = str(length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method") == "HEAD" or self.length == 0:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": self.file,
+                    "offset": self.offset,
+                    "count": self.length,
+                })
+                return
+            await run_in_threadpool(self.file.seek, self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await run_in_threadpool(self.file.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file was truncated under us; end the response instead of hanging
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            self.file.close()
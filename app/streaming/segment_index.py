@@ -0,0 +1,320 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+from typing import Callable, Dict, List, Optional
+
+from app.streaming.origin import parse_media_playlist, segment_number
+
+PLAYLIST_NAME = "master.m3u8"
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class SegmentInfo:
+    __slots__ = ("name", "sequence", "size", "mtime", "closed")
+
+    def __init__(self, name: str, size: int, mtime: float, closed: bool = False):
+        self.name = name
+        self.sequence = segment_number(name)
+        self.size = size
+        self.mtime = mtime
+        # FFmpeg finished writing it; only closed segments may be cached as immutable
+        self.closed = closed
+
+
+class ChannelSegments:
+    """
+    What is on disk for one channel: its segments and the names the
+    current playlist references. Kept up to date by file events.
+    """
+
+    def __init__(self, directory: str, playlist_name: str = PLAYLIST_NAME):
+        self.directory = directory
+        # Media playlist that decides readiness; one rendition's in ABR mode
+        self.playlist_name = playlist_name
+        self.segments: Dict[str, SegmentInfo] = {}
+        self.playlist_names: List[str] = []
+        self.playlist_updated_at: Optional[float] = None
+        self._on_ready: Optional[Callable[[], None]] = None
+        # mtime of a playlist left over from an earlier run, which does not make the channel ready
+        self._leftover_mtime: Optional[float] = None
+
+    @property
+    def count(self) -> int:
+        return len(self.segments)
+
+    @property
+    def bytes(self) -> int:
+        return sum(s.size for s in self.segments.values())
+
+    @property
+    def has_playlist(self) -> bool:
+        return self.playlist_updated_at is not None
+
+    def ordered(self) -> List[SegmentInfo]:
+        """Segments oldest first."""
+        return sorted(self.segments.values(), key=lambda s: s.sequence)
+
+    def has_ready_segment(self) -> bool:
+        return any(name in self.segments for name in self.playlist_names)
+
+    def notify_ready(self, on_ready: Callable[[], None]):
+        """Runs `on_ready` once a rewritten playlist references a segment that is on disk."""
+        self._leftover_mtime = self.playlist_updated_at
+        self._on_ready = on_ready
+
+    def file_written(self, name: str, closed: bool = True):
+        """
+        Records a file. `closed` is False when it was found by listing the
+        directory, where a segment may still be being written.
+        """
+        path = os.path.join(self.directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if name.endswith(".ts"):
+            self.segments[name] = SegmentInfo(name, st.st_size, st.st_mtime, closed)
+        elif name == self.playlist_name:
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+            except OSError:
+                return
+            self.playlist_names = [uri for uri, _ in parse_media_playlist(body)]
+            self.playlist_updated_at = st.st_mtime
+            self.check_closed()
+        else:
+            return
+        if (
+            self._on_ready is not None
+            and self.playlist_updated_at is not None
+            and self.playlist_updated_at != self._leftover_mtime
+            and self.has_ready_segment()
+        ):
+            on_ready, self._on_ready = self._on_ready, None
+            on_ready()
+
+    def check_closed(self):
+        """
+        Without close events a segment counts as closed once a newer one
+        follows it in the playlist and its size and mtime stopped changing.
+        """
+        for name in self.playlist_names[:-1]:
+            segment = self.segments.get(name)
+            if segment is None or segment.closed:
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            if st.st_size == segment.size and st.st_mtime == segment.mtime:
+                segment.closed = True
+            else:
+                segment.size = st.st_size
+                segment.mtime = st.st_mtime
+
+    def file_removed(self, name: str):
+        if name == self.playlist_name:
+            self.playlist_names = []
+            self.playlist_updated_at = None
+        else:
+            self.segments.pop(name, None)
+
+    def rescan(self, listing: Optional[Dict[str, float]] = None):
+        """
+        Reconciles with a directory listing (name -> mtime), taken here when
+        not given. This is the polling fallback's only source of changes.
+        """
+        if listing is None:
+            listing = list_directory(self.directory)
+        for name in [n for n in self.segments if n not in listing]:
+            self.file_removed(name)
+        if self.playlist_name not in listing and self.has_playlist:
+            self.file_removed(self.playlist_name)
+        for name, mtime in listing.items():
+            if name == self.playlist_name:
+                if mtime != self.playlist_updated_at:
+                    self.file_written(name)
+            elif name.endswith(".ts") and name not in self.segments:
+                self.file_written(name, closed=False)
+        self.check_closed()
+
+
+class SegmentIndex:
+    """
+    Per-channel segment index driven by inotify, falling back to polling
+    the directories when inotify is unavailable or out of watches.
+    Status, cleanup and readiness read it instead of globbing the disk.
+    """
+
+    def __init__(self, poll_interval: float = 1.0):
+        self.poll_interval = poll_interval
+        self.channels: Dict[str, ChannelSegments] = {}
+        self._fd: Optional[int] = None
+        self._libc = None
+        self._wd_to_channel: Dict[int, str] = {}
+        self._channel_to_wd: Dict[str, int] = {}
+        self._polled: Dict[str, ChannelSegments] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if self._fd is not None else "polling"
+
+    def start(self):
+        """Opens the inotify instance; must run inside the event loop."""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            fd = -1
+        if fd < 0:
+            print("inotify unavailable, polling HLS output directories instead")
+        else:
+            self._libc = libc
+            self._fd = fd
+            asyncio.get_running_loop().add_reader(fd, self._read_events)
+        self._poll_task = asyncio.create_task(self._poll())
+
+    async def close(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._wd_to_channel.clear()
+        self._channel_to_wd.clear()
+
+    def get(self, channel_name: str) -> Optional[ChannelSegments]:
+        return self.channels.get(channel_name)
+
+    def watch(
+        self,
+        channel_name: str,
+        directory: str,
+        on_ready: Optional[Callable[[], None]] = None,
+        playlist_name: str = PLAYLIST_NAME,
+        poll: bool = False,
+    ) -> ChannelSegments:
+        """
+        Starts tracking a channel directory. `on_ready` runs once, when the
+        playlist first references a segment that is on disk. `poll` skips
+        inotify, which misses files another node writes to shared storage.
+        """
+        self.unwatch(channel_name)
+        entry = self.channels[channel_name] = ChannelSegments(directory, playlist_name)
+        wd = -1
+        if self._fd is not None and not poll:
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                print(f"inotify watch failed for '{channel_name}' ({os.strerror(ctypes.get_errno())}), polling it instead")
+        if wd >= 0:
+            self._wd_to_channel[wd] = channel_name
+            self._channel_to_wd[channel_name] = wd
+        else:
+            self._polled[channel_name] = entry
+        # Files written before the watch existed
+        entry.rescan()
+        if on_ready is not None:
+            entry.notify_ready(on_ready)
+        return entry
+
+    def unwatch(self, channel_name: str):
+        self.channels.pop(channel_name, None)
+        self._polled.pop(channel_name, None)
+        wd = self._channel_to_wd.pop(channel_name, None)
+        if wd is not None:
+            self._wd_to_channel.pop(wd, None)
+            if self._fd is not None:
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; catch up from the directories themselves
+                for entry in self.channels.values():
+                    entry.rescan()
+                continue
+            channel_name = self._wd_to_channel.get(wd)
+            entry = self.channels.get(channel_name) if channel_name is not None else None
+            if entry is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                # Directory removed; keep tracking it by polling until unwatched
+                self._wd_to_channel.pop(wd, None)
+                self._channel_to_wd.pop(channel_name, None)
+                self._polled[channel_name] = entry
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                entry.file_written(name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                entry.file_removed(name)
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for channel_name, entry in list(self._polled.items()):
+                listing = await loop.run_in_executor(None, list_directory, entry.directory)
+                # The channel may have been unwatched while the listing ran
+                if self._polled.get(channel_name) is entry:
+                    entry.rescan(listing)
+
+
+def list_directory(directory: str) -> Dict[str, float]:
+    """Regular files in `directory` with their mtimes."""
+    listing = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        listing[entry.name] = entry.stat().st_mtime
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return listing
+
+
+def remove_segments(directory: str, names: List[str]) -> List[str]:
+    """Unlinks segment files; runs in an executor so the event loop never waits on the disk."""
+    removed = []
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+            removed.append(name)
+        except FileNotFoundError:
+            removed.append(name)
+        except OSError as e:
+            print(f"Error removing segment {name}: {e}")
+    return removed
@@ -0,0 +1,1061 @@
+import asyncio
+import ctypes
+import os
+import signal
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from app.core import metrics
+from app.streaming.abr import Rendition, build_abr_command, rendition_shares
+from app.streaming.logs import RotatingLog
+from app.streaming.origin import MemoryOrigin
+from app.streaming.ownership import Lease, LocalRegistry, OwnershipRegistry, node_id
+from app.streaming.progress import ProcessCpu, StreamProgress
+from app.streaming.restart_policy import OPEN, RestartPolicy
+from app.streaming.segment_index import PLAYLIST_NAME, SegmentIndex, remove_segments
+from app.streaming.timer_wheel import TimerWheel
+
+# Wheel key of the lease heartbeat; channel names never contain a slash
+REGISTRY_JOB = "/registry"
+
+
+def build_ffmpeg_command(
+    url: str, output_dir: str, ingest_url: Optional[str] = None, list_size: int = 5, start_number: int = 0
+) -> List[str]:
+    """
+    FFmpeg command for HLS live streaming with automatic segment cleanup.
+    With `ingest_url` the playlist and segments are uploaded to the in-memory
+    origin over HTTP PUT instead of being written to `output_dir`.
+    """
+    if ingest_url is not None:
+        return [
+            "ffmpeg",
+            "-progress", "pipe:1",  # Machine-readable telemetry on stdout
+            "-nostats",
+            "-i", url,
+            "-c", "copy",
+            "-hls_time", "2",
+            "-hls_list_size", str(list_size),
+            "-hls_segment_type", "mpegts",
+            "-start_number", str(start_number),
+            "-method", "PUT",
+            "-http_persistent", "1",  # Reuse one keep-alive connection for all uploads
+            "-hls_segment_filename", f"{ingest_url}/segment_%05d.ts",
+            "-f", "hls",
+            f"{ingest_url}/master.m3u8"
+        ]
+    return [
+        "ffmpeg",
+        "-progress", "pipe:1",  # Machine-readable telemetry on stdout
+        "-nostats",
+        "-i", url,
+        "-c", "copy",  # Copy both video and audio
+        "-hls_time", "2",  # 2 second segments for better live streaming
+        "-hls_list_size", "5",  # Keep only last 5 segments (10 seconds total)
+        "-hls_flags", "delete_segments+append_list",  # Auto-delete old segments
+        "-hls_delete_threshold", "1",  # Delete segments immediately after they're old
+        "-hls_segment_filename", os.path.join(output_dir, "segment_%05d.ts"),
+        "-hls_segment_type", "mpegts",
+        "-start_number", str(start_number),
+        "-f", "hls",
+        "-y",  # Overwrite output files
+        os.path.join(output_dir, "master.m3u8")
+    ]
+
+
+def build_low_latency_command(
+    url: str,
+    ingest_url: str,
+    part_duration: float,
+    segment_duration: float,
+    preset: str,
+    list_size: int = 8,
+    start_number: int = 0,
+) -> List[str]:
+    """
+    FFmpeg command for LL-HLS channels: uploads parts of `part_duration`
+    seconds to the in-memory origin, which groups them into segments.
+    `start_number` numbers the first part and must start a segment.
+    Video is re-encoded so every `segment_duration` starts on a keyframe;
+    a copied source could only be cut at its own, often sparse, keyframes.
+    """
+    return [
+        "ffmpeg",
+        "-progress", "pipe:1",  # Machine-readable telemetry on stdout
+        "-nostats",
+        "-i", url,
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-tune", "zerolatency",  # No B-frames or lookahead, frames leave the encoder at once
+        "-force_key_frames", f"expr:gte(t,n_forced*{segment_duration:g})",
+        "-c:a", "copy",
+        "-hls_time", f"{part_duration:g}",
+        "-hls_list_size", str(list_size),
+        "-hls_flags", "split_by_time",  # Parts end on time, not only on keyframes
+        "-hls_segment_type", "mpegts",
+        "-start_number", str(start_number),
+        "-method", "PUT",
+        "-http_persistent", "1",
+        "-hls_segment_filename", f"{ingest_url}/part_%05d.ts",
+        "-f", "hls",
+        f"{ingest_url}/master.m3u8"
+    ]
+
+
+class StreamBudgetExceeded(Exception):
+    """Raised when a channel cannot be admitted within the transcoder budget."""
+
+
+class StreamBackingOff(Exception):
+    """Raised when a failing channel may not be started again yet."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StreamOwnedElsewhere(Exception):
+    """Raised when another worker holds the lease of a channel's transcoder."""
+
+    def __init__(self, lease: Lease):
+        super().__init__(f"Channel '{lease.channel_name}' is transcoded by {lease.owner}")
+        self.lease = lease
+
+
+class ChannelStream:
+    """State of a single supervised FFmpeg child."""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        output_dir: str,
+        cost: float = 1.0,
+        ladder: Optional[List[Rendition]] = None,
+        low_latency: bool = False,
+    ):
+        self.name = name
+        self.url = url
+        self.output_dir = output_dir
+        self.cost = cost
+        # ABR renditions; None copies the source into a single rendition
+        self.ladder = ladder
+        # LL-HLS parts served from the in-memory origin
+        self.low_latency = low_latency
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.cpu: Optional[ProcessCpu] = None
+        self.log: Optional[RotatingLog] = None
+        self.stderr_task: Optional[asyncio.Task] = None
+        self.started_at: Optional[float] = None
+        self.restarts = 0
+        # Set when a crash or stall was handled, so it is not counted twice
+        self.failed = False
+        # Set once the first playlist and segment are written, or the process died trying
+        self.ready = asyncio.Event()
+        self.ready_ok = False
+        self.ready_timer = None
+        self.progress = StreamProgress()
+        self.progress_task: Optional[asyncio.Task] = None
+        # Viewer key -> last playlist or segment fetch
+        self.viewers: Dict[str, float] = {}
+        self.last_viewed_at = time.time()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def touch(self, viewer: str):
+        now = time.time()
+        self.viewers[viewer] = now
+        self.last_viewed_at = now
+
+    def viewer_count(self, window: float) -> int:
+        """
+        Viewers that fetched a playlist or segment within `window` seconds.
+        Only reads, so status endpoints may call it from the threadpool.
+        """
+        cutoff = time.time() - window
+        # list() copies in one step, the event loop may add viewers meanwhile
+        return sum(1 for seen in list(self.viewers.values()) if seen >= cutoff)
+
+    def prune_viewers(self, window: float):
+        """Forgets viewers that went away; runs on the event loop."""
+        cutoff = time.time() - window
+        for viewer in [v for v, seen in self.viewers.items() if seen < cutoff]:
+            del self.viewers[viewer]
+
+    @property
+    def playlist_path(self) -> str:
+        return os.path.join(self.output_dir, "master.m3u8")
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.output_dir, "ffmpeg.log")
+
+
+class StreamSupervisor:
+    """
+    Owns every FFmpeg child and runs health checks and segment GC
+    for all channels on a single timer wheel in the event loop.
+    With a shared `registry` only the worker holding a channel's lease
+    runs its FFmpeg; the others serve what it writes and take the
+    channel over when the lease expires.
+    """
+
+    def __init__(
+        self,
+        output_root: str,
+        config: Dict,
+        origin: Optional[MemoryOrigin] = None,
+        ingest_base_url: str = "",
+        idle_grace: float = 0,
+        viewer_window: float = 30,
+        keep_warm: Iterable[str] = (),
+        max_transcoders: int = 0,
+        cost_budget: float = 0,
+        eviction_policy: str = "lru",
+        admission_wait: float = 0,
+        progress_stall: float = 0,
+        min_speed: float = 0,
+        slow_grace: float = 0,
+        log_max_bytes: int = 0,
+        log_backups: int = 0,
+        abr_preset: str = "veryfast",
+        ll_part_duration: float = 0.5,
+        ll_segment_duration: float = 2.0,
+        ll_preset: str = "veryfast",
+        restart_base_delay: float = 5,
+        restart_max_delay: float = 5,
+        restart_jitter: float = 0,
+        breaker_failures: int = 0,
+        breaker_window: float = 300,
+        breaker_cooldown: float = 120,
+        registry: Optional[OwnershipRegistry] = None,
+        lease_ttl: float = 15,
+        address: str = "",
+    ):
+        self.output_root = output_root
+        self.config = config
+        self.origin = origin
+        self.ingest_base_url = ingest_base_url.rstrip("/")
+        self.idle_grace = idle_grace
+        self.viewer_window = viewer_window
+        self.keep_warm = set(keep_warm)
+        self.max_transcoders = max_transcoders
+        self.cost_budget = cost_budget
+        self.eviction_policy = eviction_policy
+        self.admission_wait = admission_wait
+        self.progress_stall = progress_stall
+        self.min_speed = min_speed
+        self.slow_grace = slow_grace
+        self.log_max_bytes = log_max_bytes
+        self.log_backups = log_backups
+        self.abr_preset = abr_preset
+        self.ll_part_duration = ll_part_duration
+        # Segments are a whole number of parts, so a keyframe starts every segment's first part
+        self.ll_parts_per_segment = max(1, round(ll_segment_duration / ll_part_duration))
+        self.ll_preset = ll_preset
+        # Kept across restarts so log cursors keep increasing
+        self.logs: Dict[str, RotatingLog] = {}
+        self.restart_base_delay = restart_base_delay
+        self.restart_max_delay = restart_max_delay
+        self.restart_jitter = restart_jitter
+        self.breaker_failures = breaker_failures
+        self.breaker_window = breaker_window
+        self.breaker_cooldown = breaker_cooldown
+        # Created on a channel's first failure and kept across restarts
+        self.restart_policies: Dict[str, RestartPolicy] = {}
+        self.evictions = 0
+        self.rejections = 0
+        self.registry = registry or LocalRegistry()
+        self.node_id = node_id()
+        # Public base URL of this worker, shared with the others through its leases
+        self.address = address
+        self.lease_ttl = lease_ttl
+        # Leases of running and standby channels as of the last heartbeat
+        self.leases: Dict[str, Lease] = {}
+        # Channels another worker transcodes that viewers here watch; taken over when their lease expires
+        self.standby: Dict[str, ChannelStream] = {}
+        self.takeovers = 0
+        self._renewed_at = time.monotonic()
+        self._views_flushed_at = time.time()
+        self.streams: Dict[str, ChannelStream] = {}
+        self.wheel = TimerWheel()
+        # Disk mode only: what each channel has written to output_root
+        self.segment_index = SegmentIndex()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Capacity held by channels that passed admission and are still spawning
+        self._reserved: Dict[str, float] = {}
+        self._admission_lock = asyncio.Lock()
+        self._capacity_freed = asyncio.Event()
+
+    async def start(self):
+        _install_child_watcher()
+        self.wheel.start()
+        if self.origin is None:
+            self.segment_index.start()
+        self.wheel.call_every(self.lease_ttl / 3, REGISTRY_JOB, self._heartbeat)
+
+    async def shutdown(self):
+        print("Shutting down. Stopping all FFmpeg processes...")
+        # Released leases let other workers take the channels over right away
+        await asyncio.gather(*(self.stop_channel(name) for name in list(self.streams)))
+        await self.wheel.stop()
+        await self.segment_index.close()
+        await self.registry.close()
+
+    def is_running(self, channel_name: str) -> bool:
+        stream = self.streams.get(channel_name)
+        return stream is not None and stream.alive
+
+    def has_jobs(self, channel_name: str) -> bool:
+        return self.wheel.has_key(channel_name)
+
+    def touch(self, channel_name: str, viewer: str):
+        """Records a playlist or segment fetch for a running or standby channel."""
+        stream = self.streams.get(channel_name) or self.standby.get(channel_name)
+        if stream is not None:
+            stream.touch(viewer)
+
+    def viewer_count(self, channel_name: str) -> int:
+        stream = self.streams.get(channel_name)
+        return stream.viewer_count(self.viewer_window) if stream is not None else 0
+
+    def idle_seconds(self, channel_name: str) -> Optional[float]:
+        stream = self.streams.get(channel_name)
+        return round(time.time() - stream.last_viewed_at, 1) if stream is not None else None
+
+    def channel_log(self, channel_name: str) -> RotatingLog:
+        log = self.logs.get(channel_name)
+        if log is None:
+            path = os.path.join(self.output_root, channel_name, "ffmpeg.log")
+            log = self.logs[channel_name] = RotatingLog(path, self.log_max_bytes, self.log_backups)
+        return log
+
+    def restart_policy(self, channel_name: str) -> RestartPolicy:
+        policy = self.restart_policies.get(channel_name)
+        if policy is None:
+            policy = self.restart_policies[channel_name] = RestartPolicy(
+                self.restart_base_delay,
+                self.restart_max_delay,
+                self.restart_jitter,
+                self.breaker_failures,
+                self.breaker_window,
+                self.breaker_cooldown,
+            )
+        return policy
+
+    def restart_status(self, channel_name: str) -> Optional[Dict]:
+        """Backoff and circuit breaker state; None for channels that never failed."""
+        policy = self.restart_policies.get(channel_name)
+        return policy.as_dict() if policy is not None else None
+
+    def transcode_status(self, channel_name: str) -> Optional[Dict]:
+        """
+        Copy or ABR mode and the process's CPU use, split across the
+        renditions by their estimated share.
+        """
+        stream = self.streams.get(channel_name)
+        if stream is None:
+            return None
+        cpu = stream.cpu.percent if stream.cpu is not None else None
+        if stream.ladder:
+            mode = "abr"
+        elif stream.low_latency:
+            mode = "ll-hls"
+        else:
+            mode = "copy"
+        status = {"mode": mode, "cpu_percent": cpu}
+        if stream.ladder:
+            status["renditions"] = [
+                dict(rendition.as_dict(), cpu_percent_estimate=round(cpu * share, 1) if cpu is not None else None)
+                for rendition, share in zip(stream.ladder, rendition_shares(stream.ladder))
+            ]
+        return status
+
+    def ownership(self, channel_name: str) -> Optional[Dict]:
+        """Which worker transcodes the channel as of the last heartbeat; None if none is known."""
+        lease = self.leases.get(channel_name)
+        if lease is None:
+            return None
+        return dict(lease.as_dict(), owned_here=lease.owner == self.node_id)
+
+    def owner_elsewhere(self, channel_name: str) -> Optional[Lease]:
+        """The lease of a channel this worker only serves, not transcodes."""
+        lease = self.leases.get(channel_name)
+        return lease if channel_name in self.standby and lease is not None else None
+
+    def progress(self, channel_name: str) -> Optional[Dict]:
+        stream = self.streams.get(channel_name)
+        if stream is None or stream.started_at is None:
+            return None
+        return stream.progress.as_dict(stream.started_at)
+
+    def budget_status(self) -> Dict:
+        used_transcoders, used_cost = self._usage()
+        return {
+            "max_transcoders": self.max_transcoders or None,
+            "cost_budget": self.cost_budget or None,
+            "used_transcoders": used_transcoders,
+            "used_cost": round(used_cost, 2),
+            "eviction_policy": self.eviction_policy,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+        }
+
+    async def wait_ready(self, channel_name: str, timeout: float) -> bool:
+        """
+        Waits until the channel has produced its first playlist and segment,
+        here or, for a standby channel, on its owner.
+        Returns False if the deadline passes or FFmpeg exits before that.
+        """
+        stream = self.streams.get(channel_name) or self.standby.get(channel_name)
+        if stream is None:
+            return False
+        if not stream.ready.is_set():
+            try:
+                await asyncio.wait_for(stream.ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return False
+        return stream.ready_ok
+
+    def _lock(self, channel_name: str) -> asyncio.Lock:
+        lock = self._locks.get(channel_name)
+        if lock is None:
+            lock = self._locks[channel_name] = asyncio.Lock()
+        return lock
+
+    async def start_channel(
+        self,
+        channel_name: str,
+        url: str,
+        cost: float = 1.0,
+        scheduled: bool = False,
+        ladder: Optional[List[Rendition]] = None,
+        low_latency: bool = False,
+    ) -> Optional[ChannelStream]:
+        """
+        Starts FFmpeg for a channel unless it is already running, transcoding
+        to the `ladder` renditions or to LL-HLS parts when asked.
+        Raises StreamBudgetExceeded if the transcoder budget has no room for it,
+        StreamBackingOff while a failing channel waits for its next attempt,
+        and StreamOwnedElsewhere when another worker holds its lease; the
+        channel is then served in standby.
+        `scheduled` marks the supervisor's own restarts, which are due now.
+        """
+        if ladder and self.origin is not None:
+            # The in-memory ring holds a single rendition
+            print(f"ABR is not available in memory origin mode, copying '{channel_name}' instead")
+            ladder = None
+        if low_latency and self.origin is None:
+            # Parts are assembled into playlists by the in-memory origin
+            print(f"LL-HLS needs memory origin mode, serving '{channel_name}' with regular segments")
+            low_latency = False
+        self.wheel.start()
+        async with self._lock(channel_name):
+            stream = self.streams.get(channel_name)
+            if stream is not None and stream.alive:
+                print(f"FFmpeg process for '{channel_name}' is already running")
+                return stream
+
+            policy = self.restart_policies.get(channel_name)
+            if policy is not None and not policy.allow_start(scheduled):
+                raise StreamBackingOff(
+                    f"Channel '{channel_name}' keeps failing, retrying in {policy.retry_after():.0f}s",
+                    policy.retry_after(),
+                )
+
+            stream = ChannelStream(
+                channel_name, url, os.path.join(self.output_root, channel_name), cost, ladder, low_latency
+            )
+            lease = self.owner_elsewhere(channel_name)
+            if lease is not None and lease.expires_at > time.time():
+                # The heartbeat notices when the owner stops renewing
+                raise StreamOwnedElsewhere(lease)
+            try:
+                lease = await self.registry.acquire(channel_name, self.node_id, self.lease_ttl, self.address)
+            except Exception as e:
+                print(f"Stream registry unavailable, not starting '{channel_name}': {e}")
+                raise StreamBackingOff(f"Stream registry unavailable: {e}", self.lease_ttl / 3)
+            if lease.owner != self.node_id:
+                self._stand_by(stream, lease)
+                raise StreamOwnedElsewhere(lease)
+            standby_owner = self.leases.get(channel_name, lease).owner
+            self.leases[channel_name] = lease
+            standby = self.standby.pop(channel_name, None)
+            if standby is not None:
+                stream.viewers = standby.viewers
+                stream.last_viewed_at = standby.last_viewed_at
+
+            await self._stop_locked(channel_name, release=False)
+            started = False
+            try:
+                await self._admit(channel_name, cost)
+                if not await self._spawn(stream):
+                    return None
+                self.streams[channel_name] = stream
+                self._schedule_jobs(stream)
+                started = True
+                if standby is not None:
+                    print(f"Took over '{channel_name}' from {standby_owner}")
+                    self.takeovers += 1
+                    metrics.stream_takeovers.inc(channel=channel_name)
+                return stream
+            finally:
+                self._reserved.pop(channel_name, None)
+                if not started:
+                    await self._release(channel_name)
+
+    async def stop_channel(self, channel_name: str, release: bool = True):
+        """
+        Stops the FFmpeg process and cancels every pending job for the channel.
+        Unless `release` is False the channel's lease is given up as well.
+        """
+        async with self._lock(channel_name):
+            await self._stop_locked(channel_name, release)
+
+    async def restart_channel(self, channel_name: str):
+        stream = self.streams.get(channel_name)
+        if stream is None:
+            return
+        # Keep the lease, so the channel is not taken over between stop and start
+        await self.stop_channel(channel_name, release=False)
+        await self._start_again(stream)
+
+    async def _start_again(self, previous: ChannelStream):
+        """Starts a stopped or failed channel again, keeping its viewers and restart count."""
+        metrics.ffmpeg_restarts.inc(channel=previous.name)
+        try:
+            stream = await self.start_channel(
+                previous.name, previous.url, previous.cost,
+                scheduled=True, ladder=previous.ladder, low_latency=previous.low_latency
+            )
+        except StreamBudgetExceeded:
+            print(f"No transcoder budget left to restart '{previous.name}'")
+            return
+        except StreamOwnedElsewhere:
+            # Taken over while this worker backed off; it is served in standby now
+            return
+        except StreamBackingOff as e:
+            # Breaker still open or the registry unreachable; try again when it allows
+            if self._wanted(previous):
+                print(f"Restart of '{previous.name}' deferred: {e}")
+                self.wheel.call_later(e.retry_after, previous.name, self._start_again, previous)
+            return
+        if stream is not None:
+            stream.restarts = previous.restarts + 1
+            stream.viewers = previous.viewers
+            stream.last_viewed_at = previous.last_viewed_at
+
+    def _usage(self):
+        count = len(self.streams) + len(self._reserved)
+        cost = sum(s.cost for s in self.streams.values()) + sum(self._reserved.values())
+        return count, cost
+
+    def _fits(self, cost: float) -> bool:
+        count, used = self._usage()
+        if self.max_transcoders and count + 1 > self.max_transcoders:
+            return False
+        if self.cost_budget and used + cost > self.cost_budget:
+            return False
+        return True
+
+    def _eviction_candidates(self, channel_name: str) -> List[ChannelStream]:
+        """Running channels without current viewers, in eviction order."""
+        candidates = [
+            stream for name, stream in self.streams.items()
+            if name != channel_name
+            and name not in self.keep_warm
+            and not self._lock(name).locked()
+            and stream.viewer_count(self.viewer_window) == 0
+            # Viewers of other workers are only known through the lease
+            and time.time() - stream.last_viewed_at > self.viewer_window
+        ]
+        if self.eviction_policy == "least_watched":
+            candidates.sort(key=lambda s: (s.viewer_count(self.viewer_window), s.last_viewed_at))
+        else:
+            candidates.sort(key=lambda s: s.last_viewed_at)
+        return candidates
+
+    async def _admit(self, channel_name: str, cost: float):
+        """
+        Reserves budget for a channel, evicting idle channels if needed.
+        When nothing can be evicted the caller backs off until capacity is
+        released or `admission_wait` runs out.
+        """
+        if not self.max_transcoders and not self.cost_budget:
+            return
+
+        deadline = time.monotonic() + self.admission_wait
+        while True:
+            freed = self._capacity_freed
+            async with self._admission_lock:
+                for victim in self._eviction_candidates(channel_name):
+                    if self._fits(cost):
+                        break
+                    # Skip channels stopped since the list was made or busy in
+                    # another start/stop; waiting on their lock here would
+                    # invert the lock order against a start holding it
+                    if self.streams.get(victim.name) is not victim or self._lock(victim.name).locked():
+                        continue
+                    print(f"Evicting idle stream '{victim.name}' to admit '{channel_name}'")
+                    self.evictions += 1
+                    async with self._lock(victim.name):
+                        await self._stop_locked(victim.name)
+                if self._fits(cost):
+                    self._reserved[channel_name] = cost
+                    return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.rejections += 1
+                raise StreamBudgetExceeded(f"No transcoder capacity for '{channel_name}'")
+            try:
+                await asyncio.wait_for(freed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _stop_locked(self, channel_name: str, release: bool = True):
+        self.wheel.cancel_key(channel_name)
+        stream = self.streams.pop(channel_name, None)
+        if stream is None:
+            return
+        # Wake up admissions that are waiting for capacity
+        self._capacity_freed.set()
+        self._capacity_freed = asyncio.Event()
+
+        process = stream.process
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+            print(f"Stopped FFmpeg process for '{channel_name}'.")
+        if stream.progress_task is not None:
+            stream.progress_task.cancel()
+            stream.progress_task = None
+        if stream.stderr_task is not None:
+            # Let the last lines FFmpeg wrote reach the log
+            try:
+                await asyncio.wait_for(stream.stderr_task, timeout=1)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            stream.stderr_task = None
+        if stream.log is not None:
+            stream.log.close()
+        if self.origin is not None:
+            self.origin.close_channel(channel_name)
+        self.segment_index.unwatch(channel_name)
+        metrics.segment_lag.remove(channel=channel_name)
+        if release:
+            await self._release(channel_name)
+
+    async def _release(self, channel_name: str):
+        self.leases.pop(channel_name, None)
+        try:
+            await self.registry.release(channel_name, self.node_id)
+        except Exception as e:
+            # The lease runs out on its own
+            print(f"Could not release the lease of '{channel_name}': {e}")
+
+    def _stand_by(self, stream: ChannelStream, lease: Optional[Lease] = None):
+        """
+        Serves a channel another worker transcodes: its directory is
+        polled, which also sees files written on other nodes, and the
+        heartbeat takes it over once the owner stops renewing the lease.
+        """
+        if lease is not None:
+            self.leases[stream.name] = lease
+        if stream.name in self.standby:
+            return
+        self.standby[stream.name] = stream
+        if self.origin is not None:
+            # The playlist is in the owner's memory; nothing to wait for here
+            stream.ready.set()
+            return
+        playlist_name = stream.ladder[-1].playlist_name if stream.ladder else PLAYLIST_NAME
+        entry = self.segment_index.watch(
+            stream.name, stream.output_dir, lambda: self._mark_standby_ready(stream), playlist_name, poll=True
+        )
+        if entry.has_ready_segment() and entry.playlist_updated_at > time.time() - self.lease_ttl:
+            # The owner is writing the channel right now
+            self._mark_standby_ready(stream)
+
+    def _mark_standby_ready(self, stream: ChannelStream):
+        stream.ready_ok = True
+        stream.ready.set()
+
+    def _leave_standby(self, channel_name: str):
+        self.standby.pop(channel_name, None)
+        self.leases.pop(channel_name, None)
+        if channel_name not in self.streams:
+            self.segment_index.unwatch(channel_name)
+
+    def _wanted(self, stream: ChannelStream) -> bool:
+        """Whether a channel should keep running if it were up to this worker."""
+        return (
+            self.idle_grace <= 0
+            or stream.name in self.keep_warm
+            or time.time() - stream.last_viewed_at < self.idle_grace
+        )
+
+    async def _heartbeat(self):
+        """
+        Renews the leases of the running channels, reports this worker's
+        viewers of standby channels to their owners and takes over standby
+        channels whose lease expired.
+        """
+        names = list(self.streams)
+        try:
+            held = await self.registry.renew(self.node_id, names, self.lease_ttl)
+        except Exception as e:
+            print(f"Could not renew stream leases: {e}")
+            if time.monotonic() - self._renewed_at > self.lease_ttl:
+                # Other workers may have taken the channels over by now
+                for name in names:
+                    await self._lose_lease(name)
+            return
+        self._renewed_at = time.monotonic()
+        for name in names:
+            stream = self.streams.get(name)
+            lease = held.get(name)
+            if stream is None:
+                continue
+            if lease is None:
+                await self._lose_lease(name)
+                continue
+            self.leases[name] = lease
+            if lease.viewed_at is not None:
+                stream.last_viewed_at = max(stream.last_viewed_at, lease.viewed_at)
+
+        if not self.standby:
+            return
+        now = time.time()
+        viewed = {
+            name: stream.last_viewed_at
+            for name, stream in self.standby.items()
+            if stream.last_viewed_at > self._views_flushed_at
+        }
+        try:
+            await self.registry.touch(viewed)
+            self._views_flushed_at = now
+        except Exception as e:
+            # Reported again with the next heartbeat
+            print(f"Could not report standby viewers: {e}")
+        try:
+            owners = await self.registry.owners(list(self.standby))
+        except Exception as e:
+            # Without the owners a takeover could race a live lease; wait for the next heartbeat
+            print(f"Could not look up standby channel owners: {e}")
+            return
+        for name, standby in list(self.standby.items()):
+            if not self._wanted(standby):
+                self._leave_standby(name)
+                continue
+            lease = owners.get(name)
+            if lease is not None and lease.owner != self.node_id:
+                self.leases[name] = lease
+                continue
+            try:
+                await self.start_channel(
+                    name, standby.url, standby.cost, ladder=standby.ladder, low_latency=standby.low_latency
+                )
+            except StreamOwnedElsewhere:
+                pass
+            except (StreamBudgetExceeded, StreamBackingOff) as e:
+                print(f"Could not take over '{name}': {e}")
+
+    async def _lose_lease(self, channel_name: str):
+        """Stops a channel whose lease went to another worker and keeps serving it in standby."""
+        async with self._lock(channel_name):
+            stream = self.streams.get(channel_name)
+            if stream is None:
+                return
+            print(f"Lost the lease of '{channel_name}', stopping its FFmpeg")
+            metrics.stream_leases_lost.inc(channel=channel_name)
+            await self._stop_locked(channel_name, release=False)
+        self.leases.pop(channel_name, None)
+        standby = ChannelStream(
+            stream.name, stream.url, stream.output_dir, stream.cost, stream.ladder, stream.low_latency
+        )
+        standby.viewers = stream.viewers
+        standby.last_viewed_at = stream.last_viewed_at
+        self._stand_by(standby)
+
+    async def _spawn(self, stream: ChannelStream) -> bool:
+        os.makedirs(stream.output_dir, exist_ok=True)
+        ingest_url = None
+        if self.origin is not None:
+            if stream.low_latency:
+                token = self.origin.open_channel(
+                    stream.name, lambda: self._mark_ready(stream),
+                    part_target=self.ll_part_duration,
+                    parts_per_segment=self.ll_parts_per_segment,
+                )
+            else:
+                token = self.origin.open_channel(stream.name, lambda: self._mark_ready(stream))
+            ingest_url = f"{self.ingest_base_url}/hls_streams/_ingest/{stream.name}/{token}"
+        else:
+            # FFmpeg writes the master playlist once every rendition has a segment,
+            # just before the last rendition's playlist
+            playlist_name = stream.ladder[-1].playlist_name if stream.ladder else PLAYLIST_NAME
+            self.segment_index.watch(stream.name, stream.output_dir, lambda: self._mark_ready(stream), playlist_name)
+        # Segments may be cached as immutable by their URL, so every run numbers
+        # them from the clock; a run never outpaces one segment per second
+        start_number = int(time.time())
+        if stream.ladder:
+            ffmpeg_cmd = build_abr_command(
+                stream.url, stream.output_dir, stream.ladder, self.abr_preset, start_number=start_number
+            )
+        elif stream.low_latency:
+            # Parts are numbered so that part // parts_per_segment is the segment number
+            ffmpeg_cmd = build_low_latency_command(
+                stream.url, ingest_url, self.ll_part_duration,
+                self.ll_part_duration * self.ll_parts_per_segment, self.ll_preset,
+                start_number=start_number * self.ll_parts_per_segment
+            )
+        else:
+            ffmpeg_cmd = build_ffmpeg_command(
+                stream.url, stream.output_dir, ingest_url,
+                list_size=self.origin.capacity if self.origin else 5, start_number=start_number
+            )
+
+        print(f"Starting optimized FFmpeg process for '{stream.name}'...")
+        try:
+            log = stream.log = self.channel_log(stream.name)
+            log.open()
+            log.write_line(f"FFmpeg command: {' '.join(ffmpeg_cmd)}")
+            log.write_line(f"Started at: {datetime.now()}\n")
+
+            stream.process = await asyncio.create_subprocess_exec(
+                *ffmpeg_cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                preexec_fn=_die_with_worker if _prctl is not None else None,
+            )
+            stream.started_at = time.time()
+            stream.cpu = ProcessCpu(stream.process.pid)
+            stream.cpu.sample()
+            stream.progress_task = asyncio.create_task(self._read_progress(stream))
+            stream.stderr_task = asyncio.create_task(self._capture_stderr(stream))
+            metrics.ffmpeg_starts.inc(channel=stream.name)
+            print(f"FFmpeg process started for '{stream.name}'")
+            return True
+        except FileNotFoundError:
+            print("FFmpeg not found. Please ensure it is installed and in your system's PATH.")
+        except Exception as e:
+            print(f"An error occurred while starting FFmpeg for '{stream.name}': {e}")
+        if stream.log is not None:
+            stream.log.close()
+        if self.origin is not None:
+            self.origin.close_channel(stream.name)
+        self.segment_index.unwatch(stream.name)
+        return False
+
+    def _schedule_jobs(self, stream: ChannelStream):
+        stream.ready_timer = self.wheel.call_every(0.5, stream.name, self._probe_ready, stream)
+        if self.origin is None:
+            # The in-memory ring is bounded on its own, there is nothing to unlink
+            self.wheel.call_every(self.config["cleanup_interval"], stream.name, self._collect_segments, stream)
+        self.wheel.call_every(self.config["monitor_interval"], stream.name, self._check_health, stream)
+        self.wheel.call_every(5, stream.name, stream.cpu.sample)
+        if self.progress_stall > 0 or self.slow_grace > 0:
+            self.wheel.call_every(2, stream.name, self._check_progress, stream)
+        if self.idle_grace > 0 and stream.name not in self.keep_warm:
+            self.wheel.call_every(min(15, max(1, self.idle_grace / 4)), stream.name, self._check_idle, stream)
+        print(f"Scheduled cleanup and health checks for '{stream.name}'")
+
+    def _mark_ready(self, stream: ChannelStream):
+        if stream.ready.is_set():
+            return
+        stream.ready_ok = True
+        stream.ready.set()
+        policy = self.restart_policies.get(stream.name)
+        if policy is not None:
+            policy.record_success()
+        elapsed = time.time() - stream.started_at
+        metrics.time_to_first_segment.observe(elapsed, channel=stream.name)
+        print(f"Stream '{stream.name}' is ready after {elapsed:.1f}s")
+
+    async def _check_idle(self, stream: ChannelStream):
+        if self.streams.get(stream.name) is not stream:
+            return
+        idle = time.time() - stream.last_viewed_at
+        if idle > self.idle_grace:
+            print(f"Stream '{stream.name}' has had no viewers for {idle:.0f}s, stopping...")
+            await self.stop_channel(stream.name)
+
+    def _probe_ready(self, stream: ChannelStream):
+        # The ring or the segment index mark the stream ready; this only catches early deaths
+        if not stream.alive:
+            stream.ready.set()
+        if stream.ready.is_set():
+            stream.ready_timer.cancel()
+
+    def last_output_at(self, stream: ChannelStream) -> Optional[float]:
+        """When the channel last produced a playlist update."""
+        if self.origin is not None:
+            ring = self.origin.ring(stream.name)
+            return ring.updated_at if ring is not None else None
+        entry = self.segment_index.get(stream.name)
+        return entry.playlist_updated_at if entry is not None else None
+
+    async def _collect_segments(self, stream: ChannelStream):
+        """
+        Removes old HLS segments FFmpeg left behind, keeping a few more than
+        the playlist references. Candidates come from the segment index.
+        """
+        entry = self.segment_index.get(stream.name)
+        # Every rendition keeps its own window of segments
+        renditions = len(stream.ladder) if stream.ladder else 1
+        max_segments = self.config["max_segments"] * renditions
+        if entry is None or entry.count <= max_segments + 3 * renditions:  # Keep extra buffer
+            return
+        # Only remove segments older than 30 seconds to avoid race conditions
+        cutoff = time.time() - 30
+        names = [s.name for s in entry.ordered()[:-(max_segments + 2 * renditions)] if s.mtime < cutoff]
+        if not names:
+            return
+        loop = asyncio.get_running_loop()
+        with metrics.cleanup_duration.time():
+            removed = await loop.run_in_executor(None, remove_segments, stream.output_dir, names)
+        for segment in removed:
+            entry.file_removed(segment)
+            print(f"Removed old segment: {segment}")
+
+    async def _check_health(self, stream: ChannelStream):
+        if self.streams.get(stream.name) is not stream:
+            return
+        stream.prune_viewers(self.viewer_window)
+
+        if not stream.alive:
+            self._handle_exit(stream)
+            return
+
+        # Check if the playlist was updated recently
+        mod_time = self.last_output_at(stream)
+        if mod_time is None:
+            return
+        lag = time.time() - mod_time
+        metrics.segment_lag.set(lag, channel=stream.name)
+        if lag > self.config["monitor_interval"] * 2:
+            self._restart_later(stream, f"produced no output for {lag:.0f}s")
+
+    def _handle_exit(self, stream: ChannelStream):
+        if stream.failed:
+            return  # Terminated by _restart_later
+        metrics.ffmpeg_crashes.inc(channel=stream.name)
+        self._restart_later(stream, f"exited with code {stream.process.returncode}")
+
+    def _restart_later(self, stream: ChannelStream, reason: str):
+        """
+        Stops a crashed or stalled process and schedules the restart after
+        the channel's backoff delay. When the failure opens the circuit the
+        channel is stopped and, if anyone still wants it, retried once the
+        cooldown is over.
+        """
+        stream.failed = True
+        self.wheel.cancel_key(stream.name)
+        if stream.alive:
+            stream.process.terminate()
+        policy = self.restart_policy(stream.name)
+        delay = policy.record_failure(reason, time.time() - stream.started_at)
+        if delay is not None:
+            print(f"Stream '{stream.name}' {reason}, restarting in {delay:.1f}s...")
+            self.wheel.call_later(delay, stream.name, self.restart_channel, stream.name)
+            return
+        metrics.circuit_trips.inc(channel=stream.name)
+        print(f"Stream '{stream.name}' {reason}, circuit open for {policy.retry_after():.0f}s")
+        self.wheel.call_later(0, stream.name, self._open_circuit, stream)
+
+    async def _open_circuit(self, stream: ChannelStream):
+        await self.stop_channel(stream.name)
+        policy = self.restart_policy(stream.name)
+        if self._wanted(stream) and policy.state == OPEN:
+            # Half-open probe; stop_channel cancels it along with everything else
+            self.wheel.call_later(policy.retry_after(), stream.name, self._start_again, stream)
+
+    async def _read_progress(self, stream: ChannelStream):
+        """
+        Parses FFmpeg's -progress output for the lifetime of the process and
+        notices the exit as soon as stdout closes.
+        """
+        process = stream.process
+        async for line in process.stdout:
+            stream.progress.feed(line.decode("utf-8", "replace"), self.min_speed)
+        await process.wait()
+        if self.streams.get(stream.name) is stream:
+            stream.progress_task = None
+            self._handle_exit(stream)
+
+    async def _capture_stderr(self, stream: ChannelStream):
+        """Copies FFmpeg's stderr into the channel's size-capped log."""
+        stderr = stream.process.stderr
+        while True:
+            chunk = await stderr.read(65536)
+            if not chunk:
+                return
+            stream.log.write(chunk)
+
+    async def _check_progress(self, stream: ChannelStream):
+        """
+        Restarts a channel whose output clock stopped or that has been
+        slower than real time for too long, within seconds.
+        """
+        if self.streams.get(stream.name) is not stream or not stream.alive:
+            return
+        progress = stream.progress
+        if self.progress_stall > 0:
+            # Connecting to the source may take a while before the first frame
+            limit = self.progress_stall if progress.advanced_at else max(self.progress_stall * 3, 30)
+            stalled = progress.stalled_for(stream.started_at)
+            if stalled > limit:
+                self._restart_later(stream, f"output stalled for {stalled:.0f}s")
+                return
+        if self.slow_grace > 0 and progress.slow_since is not None:
+            slow = time.time() - progress.slow_since
+            if slow > self.slow_grace:
+                self._restart_later(stream, f"ran at {progress.speed}x for {slow:.0f}s")
+
+
+def _install_child_watcher():
+    """
+    Before Python 3.12 asyncio waits for children with one thread each.
+    Use a pidfd watcher where the kernel supports it so that no thread
+    is spawned per FFmpeg process.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return
+    if isinstance(asyncio.get_child_watcher(), asyncio.PidfdChildWatcher):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(asyncio.get_running_loop())
+    asyncio.set_child_watcher(watcher)
+
+
+# Linux only: lets FFmpeg ask to be killed together with its worker
+_prctl = None
+if sys.platform.startswith("linux"):
+    try:
+        _prctl = ctypes.CDLL(None, use_errno=True).prctl
+    except (OSError, AttributeError):
+        pass
+PR_SET_PDEATHSIG = 1
+
+
+def _die_with_worker():
+    """
+    Runs in the forked child before exec. When a worker dies without
+    stopping its channels, their FFmpeg processes die with it instead of
+    writing alongside the worker that takes them over.
+    """
+    _prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
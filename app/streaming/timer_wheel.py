@@ -0,0 +1,149 @@
+import asyncio
+import inspect
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+
+class TimerHandle:
+    """A single scheduled callback in the wheel."""
+
+    __slots__ = ("key", "callback", "args", "deadline", "rounds", "slot", "interval", "cancelled")
+
+    def __init__(self, key: Hashable, callback: Callable, args: tuple, deadline: float, interval: Optional[float]):
+        self.key = key
+        self.callback = callback
+        self.args = args
+        self.deadline = deadline
+        self.interval = interval
+        self.rounds = 0
+        self.slot = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel driven by a single asyncio task.
+
+    Every timer belongs to a key (the channel name), so all work for a channel
+    can be cancelled at once, including coroutines that are already running.
+    Recurring timers are rescheduled only after the previous run finished,
+    so a slow job never overlaps with itself.
+    """
+
+    def __init__(self, tick: float = 0.5, slots: int = 512):
+        self.tick = tick
+        self.slots: List[Set[TimerHandle]] = [set() for _ in range(slots)]
+        self.cursor = 0
+        self._handles: Dict[Hashable, Set[TimerHandle]] = {}
+        self._tasks: Dict[Hashable, Set[asyncio.Task]] = {}
+        self._runner: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None and not self._runner.done()
+
+    def start(self):
+        if not self.running:
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        for key in list(self._handles) + list(self._tasks):
+            self.cancel_key(key)
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def call_later(self, delay: float, key: Hashable, callback: Callable, *args) -> TimerHandle:
+        """Runs `callback(*args)` once after `delay` seconds."""
+        handle = TimerHandle(key, callback, args, time.monotonic() + delay, None)
+        self._insert(handle, delay)
+        return handle
+
+    def call_every(self, interval: float, key: Hashable, callback: Callable, *args, first_delay: Optional[float] = None) -> TimerHandle:
+        """Runs `callback(*args)` every `interval` seconds until cancelled."""
+        delay = interval if first_delay is None else first_delay
+        handle = TimerHandle(key, callback, args, time.monotonic() + delay, interval)
+        self._insert(handle, delay)
+        return handle
+
+    def cancel_key(self, key: Hashable):
+        """Cancels every timer and running job that belongs to `key`."""
+        for handle in self._handles.pop(key, set()):
+            handle.cancel()
+            self.slots[handle.slot].discard(handle)
+        for task in self._tasks.pop(key, set()):
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    def has_key(self, key: Hashable) -> bool:
+        return bool(self._handles.get(key)) or bool(self._tasks.get(key))
+
+    def _insert(self, handle: TimerHandle, delay: float):
+        ticks = max(1, int(round(delay / self.tick)))
+        handle.rounds, offset = divmod(ticks - 1, len(self.slots))
+        handle.slot = (self.cursor + 1 + offset) % len(self.slots)
+        self.slots[handle.slot].add(handle)
+        self._handles.setdefault(handle.key, set()).add(handle)
+
+    def _forget(self, handle: TimerHandle):
+        handles = self._handles.get(handle.key)
+        if handles is not None:
+            handles.discard(handle)
+            if not handles:
+                self._handles.pop(handle.key, None)
+
+    async def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            bucket = self.slots[self.cursor]
+            due = [h for h in bucket if h.rounds == 0]
+            for handle in bucket:
+                if handle.rounds > 0:
+                    handle.rounds -= 1
+            for handle in due:
+                bucket.discard(handle)
+                if handle.cancelled:
+                    self._forget(handle)
+                else:
+                    self._fire(handle)
+
+    def _fire(self, handle: TimerHandle):
+        try:
+            result = handle.callback(*handle.args)
+        except Exception as e:
+            print(f"Timer callback for '{handle.key}' failed: {e}")
+            result = None
+
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._tasks.setdefault(handle.key, set()).add(task)
+            task.add_done_callback(lambda t, h=handle: self._job_done(h, t))
+        elif handle.interval is not None and not handle.cancelled:
+            self._insert(handle, handle.interval)
+        else:
+            self._forget(handle)
+
+    def _job_done(self, handle: TimerHandle, task: asyncio.Task):
+        tasks = self._tasks.get(handle.key)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                self._tasks.pop(handle.key, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Timer job for '{handle.key}' failed: {task.exception()}")
+        if handle.cancelled:
+            return
+        if handle.interval is not None and not task.cancelled():
+            self._insert(handle, handle.interval)
+        else:
+            self._forget(handle)
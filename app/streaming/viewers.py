@@ -0,0 +1,7 @@
+from typing import Optional
+
+
+def viewer_key(client_host: Optional[str], user_agent: Optional[str]) -> str:
+    """Identifies a viewer by address and player, which is stable across segment fetches."""
+    return f"{client_host or '-'}|{user_agent or '-'}"
+